@@ -0,0 +1,190 @@
+import time
+import logging
+import argparse
+from collections import namedtuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+DEFAULT_ALPHA = 0.02         # EWMA weight of the newest reading
+DEFAULT_THRESHOLD = 4.0      # |z| above which a reading is abnormal
+DEFAULT_WARMUP = 40          # readings before a stream can raise alerts
+DEFAULT_COOLDOWN = 600.0     # seconds between alerts for the same stream
+MIN_STD = (2.0, 0.15)        # noise floor for (BPM, temperature)
+
+Anomaly = namedtuple("Anomaly", ["key", "metric", "value", "mean", "z"])
+
+class AnomalyDetector:
+    """Per-stream EWMA mean/variance with z-score flagging.
+
+    Each stream (a device or profile key) owns one slot in a set of flat numpy
+    arrays, so the state for 10k streams is a few hundred kilobytes and every
+    reading costs O(1) regardless of history length.
+    """
+
+    def __init__(self, alpha: float = DEFAULT_ALPHA, threshold: float = DEFAULT_THRESHOLD,
+                 warmup: int = DEFAULT_WARMUP, cooldown: float = DEFAULT_COOLDOWN, capacity: int = 64):
+        self.alpha = alpha
+        self.threshold = threshold
+        self.warmup = warmup
+        self.cooldown = cooldown
+        self.slots = {}
+        self.keys = []
+        self._allocate(capacity)
+
+    def _allocate(self, capacity: int):
+        old = getattr(self, "count", None)
+        size = 0 if old is None else len(old)
+        arrays = {
+            "count": np.zeros(capacity, dtype=np.int32),
+            "mean": np.zeros((capacity, 2), dtype=np.float64),
+            "var": np.zeros((capacity, 2), dtype=np.float64),
+            "last_alert": np.full(capacity, -np.inf, dtype=np.float64),
+        }
+        for name, array in arrays.items():
+            if size:
+                array[:size] = getattr(self, name)
+            setattr(self, name, array)
+
+    def slot(self, key) -> int:
+        """Returns the slot for a stream, registering it on first sight."""
+        index = self.slots.get(key)
+        if index is None:
+            index = len(self.keys)
+            if index == len(self.count):
+                self._allocate(len(self.count) * 2)
+            self.slots[key] = index
+            self.keys.append(key)
+        return index
+
+    def update(self, key, bpm: float, temp: float, now: float = None) -> list:
+        """Folds one reading into its stream and returns any anomalies it raises."""
+        index = self.slot(key)
+        x = (bpm, temp)
+        n = int(self.count[index])
+        anomalies = []
+        if n == 0:
+            self.mean[index] = x
+        else:
+            mean = self.mean[index]
+            var = self.var[index]
+            for m, (metric, value) in enumerate((("bpm_avg", bpm), ("temperature", temp))):
+                diff = value - mean[m]
+                if n >= self.warmup:
+                    z = diff / max(var[m] ** 0.5, MIN_STD[m])
+                    if abs(z) >= self.threshold:
+                        anomalies.append(Anomaly(key, metric, value, round(float(mean[m]), 2), round(float(z), 2)))
+                incr = self.alpha * diff
+                mean[m] += incr
+                var[m] = (1 - self.alpha) * (var[m] + diff * incr)
+        self.count[index] = n + 1
+        if anomalies:
+            now = time.time() if now is None else now
+            if now - self.last_alert[index] < self.cooldown:
+                return []
+            self.last_alert[index] = now
+        return anomalies
+
+    def update_batch(self, indices: np.ndarray, values: np.ndarray, now: float = None) -> np.ndarray:
+        """Vectorized update for one reading per stream, e.g. one device tick.
+
+        `indices` must not repeat within a batch; `values` has shape (n, 2) with
+        BPM and temperature columns. Returns the slots that raised an alert.
+        """
+        alerted, _, _ = self._step(indices, values, now)
+        return indices[alerted]
+
+    def _step(self, indices: np.ndarray, values: np.ndarray, now: float = None):
+        """Applies `update_batch` and returns (alerted mask, means before the update, z-scores)."""
+        now = time.time() if now is None else now
+        n = self.count[indices]
+        mean = self.mean[indices]
+        var = self.var[indices]
+        first = n == 0
+        mean[first] = values[first]
+        diff = values - mean
+        z = diff / np.maximum(np.sqrt(var), MIN_STD)
+        alerted = (np.abs(z) >= self.threshold).any(axis=1) & (n >= self.warmup)
+        incr = self.alpha * diff
+        self.mean[indices] = mean + incr
+        self.var[indices] = (1 - self.alpha) * (var + diff * incr)
+        self.count[indices] = n + 1
+        alerted &= (now - self.last_alert[indices]) >= self.cooldown
+        self.last_alert[indices[alerted]] = now
+        return alerted, mean, z
+
+METRICS = ("bpm_avg", "temperature")
+
+def detect_anomalies(detector: AnomalyDetector, rows: list, now: float = None) -> list:
+    """Feeds followhour rows to the detector, one stream per device, and returns (anomaly, row) pairs.
+
+    Rows are applied with `update_batch` in passes: pass k holds the k-th
+    reading of every device in the page, so no pass repeats a slot and each
+    device still sees its readings in order. Matches calling `update()` per row.
+    """
+    valid = [row for row in rows if row.get("bpm_avg") is not None and row.get("temperature") is not None]
+    if not valid:
+        return []
+    keys = [row.get("device_id") or "default" for row in valid]
+    slot = detector.slot
+    indices = np.fromiter((slot(key) for key in keys), dtype=np.int64, count=len(keys))
+    values = np.array([(row["bpm_avg"], row["temperature"]) for row in valid], dtype=np.float64)
+    seen = {}
+    passes = np.empty(len(keys), dtype=np.int64)
+    for i, key in enumerate(keys):
+        passes[i] = seen[key] = seen.get(key, -1) + 1
+    # Positions of each pass, in page order within the pass.
+    order = np.split(np.argsort(passes, kind="stable"), np.cumsum(np.bincount(passes))[:-1])
+
+    hits = []
+    for positions in order:
+        alerted, mean, z = detector._step(indices[positions], values[positions], now)
+        for j in np.flatnonzero(alerted):
+            i = positions[j]
+            for m, metric in enumerate(METRICS):
+                if abs(z[j, m]) >= detector.threshold:
+                    anomaly = Anomaly(keys[i], metric, float(values[i, m]), round(float(mean[j, m]), 2),
+                                      round(float(z[j, m]), 2))
+                    hits.append((i, anomaly))
+    hits.sort(key=lambda hit: hit[0])
+    return [(anomaly, valid[i]) for i, anomaly in hits]
+
+# --- BENCHMARK ---
+def benchmark(users: int = 10_000, interval: int = 15, hours: float = 24.0, page_size: int = 1000, seed: int = 0):
+    """Runs a synthetic day through `detect_anomalies`, the path the bot's poll uses.
+
+    Readings arrive as the bot sees them: followhour row dicts in pages of
+    `page_size`. Building the rows is excluded from the timing.
+    """
+    rng = np.random.default_rng(seed)
+    keys = [f"device-{i}" for i in range(users)]
+    base = np.column_stack([rng.uniform(60, 90, users), rng.uniform(36.2, 37.0, users)])
+    noise = np.array([3.0, 0.1])
+    ticks = max(int(hours * 3600) // interval, 1)
+    detector = AnomalyDetector(capacity=users)
+    alerts = 0
+    elapsed = 0.0
+    for tick in range(ticks):
+        values = base + rng.standard_normal((users, 2)) * noise
+        values[rng.random(users) < 1e-4, 0] += 60
+        rows = [{"device_id": key, "bpm_avg": bpm, "temperature": temp} for key, (bpm, temp) in zip(keys, values.tolist())]
+        now = tick * interval
+        started = time.perf_counter()
+        for i in range(0, users, page_size):
+            alerts += len(detect_anomalies(detector, rows[i:i + page_size], now=now))
+        elapsed += time.perf_counter() - started
+    readings = ticks * users
+    state_bytes = sum(a.nbytes for a in (detector.count, detector.mean, detector.var, detector.last_alert))
+    print(f"{readings:,} readings for {users:,} users ({hours:g} h at {interval} s) in {elapsed:.1f}s "
+          f"({elapsed / readings * 1e6:.2f} us/reading), {alerts:,} alerts, state {state_bytes / 1024:.0f} KiB")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the streaming anomaly detector.")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--interval", type=int, default=15, help="Seconds between readings (firmware default: 15).")
+    parser.add_argument("--hours", type=float, default=24.0, help="Synthetic hours to run (a full day by default).")
+    parser.add_argument("--page-size", type=int, default=1000, help="Rows per poll page (the bot reads 1000).")
+    args = parser.parse_args()
+    benchmark(users=args.users, interval=args.interval, hours=args.hours, page_size=args.page_size)
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import base64
+import logging
+
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+from supabase import create_client
+
+from charts import POINT_BUDGET, RANGE_HELP, RangeCache, load_series, parse_range, range_cache_key
+from queries import fetch_page, page_cursor, parse_timestamp
+from rollups import DEFAULT_DEVICE_ID, ROLLUP_TABLES, fetch_rollups, summarize
+
+# Load environment variables
+load_dotenv()
+
+# --- CONFIGURATION ---
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+ALLOWED_ORIGINS = os.getenv("API_ALLOWED_ORIGINS", "*").split(",")
+TABLES = ("followhour", "onetest")
+MAX_PAGE_SIZE = 200
+AUTH_CACHE_TTL = 60  # seconds a verified access token is trusted without re-checking
+
+if not all([SUPABASE_URL, SUPABASE_KEY]):
+    raise ValueError("Missing required environment variables: SUPABASE_URL or SUPABASE_KEY")
+
+logger = logging.getLogger(__name__)
+
+supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+series_cache = RangeCache()
+_auth_cache = {}
+
+# --- HELPERS ---
+def encode_cursor(cursor) -> str:
+    if cursor is None:
+        return None
+    return base64.urlsafe_b64encode(json.dumps(cursor).encode()).decode()
+
+def decode_cursor(value: str):
+    """Decodes a client cursor, rebuilding the timestamp so nothing else reaches the PostgREST filter."""
+    if not value:
+        return None
+    try:
+        last_time, last_id = json.loads(base64.urlsafe_b64decode(value.encode()))
+        return parse_timestamp(last_time).isoformat(), int(last_id)
+    except (ValueError, TypeError, AttributeError):
+        raise ValueError("Invalid cursor.") from None
+
+def query_timestamp(request, name: str):
+    """Re-serializes an optional ISO timestamp query parameter, like `decode_cursor` does for cursors."""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        return parse_timestamp(value).isoformat()
+    except (ValueError, TypeError):
+        raise ValueError(f"Invalid {name} timestamp.") from None
+
+def error(message: str, status_code: int = 400) -> JSONResponse:
+    return JSONResponse({"error": message}, status_code=status_code)
+
+def _is_approved(token: str) -> bool:
+    """Checks a Supabase access token belongs to an approved profile."""
+    cached = _auth_cache.get(token)
+    if cached and cached[0] > time.time():
+        return cached[1]
+    try:
+        user = supabase.auth.get_user(token).user
+        profile = supabase.table("user_profiles").select("status,role").eq("id", user.id).single().execute().data
+        approved = profile.get("status") == "approved" or profile.get("role") == "admin"
+    except Exception as e:
+        logger.warning(f"Rejected API token: {e}")
+        approved = False
+    if len(_auth_cache) > 1000:
+        now = time.time()
+        for stale in [t for t, (expires, _) in _auth_cache.items() if expires < now]:
+            del _auth_cache[stale]
+    _auth_cache[token] = (time.time() + AUTH_CACHE_TTL, approved)
+    return approved
+
+async def authorize(request) -> bool:
+    header = request.headers.get("authorization", "")
+    if not header.lower().startswith("bearer "):
+        return False
+    return await run_in_threadpool(_is_approved, header[7:])
+
+# --- ENDPOINTS ---
+async def rows_endpoint(request):
+    """One keyset page of raw readings, newest first."""
+    if not await authorize(request):
+        return error("Unauthorized.", 401)
+    table_name = request.path_params["table"]
+    if table_name not in TABLES:
+        return error("Unknown table.", 404)
+    try:
+        limit = min(max(int(request.query_params.get("limit", 10)), 1), MAX_PAGE_SIZE)
+        after = decode_cursor(request.query_params.get("cursor"))
+    except (ValueError, TypeError):
+        return error("Invalid limit or cursor.")
+    try:
+        start, end = query_timestamp(request, "start"), query_timestamp(request, "end")
+    except ValueError as e:
+        return error(str(e))
+    columns = "id,time,bpm_avg,temperature" if table_name == "followhour" else "id,date,bpm_avg,temperature"
+    try:
+        rows = await run_in_threadpool(fetch_page, supabase, table_name, columns=columns, limit=limit, after=after,
+                                       desc=True, start=start, end=end)
+    except Exception as e:
+        logger.error(f"Error fetching {table_name} page: {e}")
+        return error("An error occurred while fetching data.", 502)
+    next_cursor = encode_cursor(page_cursor(rows, table_name)) if len(rows) == limit else None
+    return JSONResponse({"rows": rows, "next": next_cursor})
+
+async def series_endpoint(request):
+    """BPM and temperature over a range, downsampled to a fixed point budget."""
+    if not await authorize(request):
+        return error("Unauthorized.", 401)
+    range_text = request.query_params.get("range", "24h")
+    timezone = request.query_params.get("tz", "Asia/Ho_Chi_Minh")
+    try:
+        points = min(max(int(request.query_params.get("points", POINT_BUDGET)), 10), 5000)
+        start, end = parse_range(range_text, timezone)
+    except Exception:
+        return error(f"Invalid range or timezone. Please use one of: {RANGE_HELP}.")
+
+    key = range_cache_key(DEFAULT_DEVICE_ID, range_text, timezone, end, points)
+    payload = series_cache.get(key)
+    if payload is None:
+        try:
+            data = await run_in_threadpool(load_series, supabase, start, end, budget=points)
+        except Exception as e:
+            logger.error(f"Error loading series for {range_text}: {e}")
+            return error("An error occurred while fetching data.", 502)
+        payload = {"start": start.isoformat(), "end": end.isoformat(), "source": None, "series": {}}
+        if data:
+            payload["source"] = data["source"]
+            payload["series"] = {
+                name: {field: [round(float(v), 3) for v in values] for field, values in series.items()}
+                for name, series in data["series"].items()
+            }
+        series_cache.put(key, payload, end)
+    return JSONResponse(payload)
+
+async def rollups_endpoint(request):
+    """Hourly or daily summaries (count, min, max, mean, std)."""
+    if not await authorize(request):
+        return error("Unauthorized.", 401)
+    grain = request.query_params.get("grain", "day")
+    if grain not in ROLLUP_TABLES:
+        return error(f"Unknown grain. Please use one of: {', '.join(ROLLUP_TABLES)}.")
+    try:
+        start, end = query_timestamp(request, "start"), query_timestamp(request, "end")
+    except ValueError as e:
+        return error(str(e))
+    rows, error_msg = await run_in_threadpool(fetch_rollups, supabase, grain, start, end)
+    if error_msg:
+        return error(error_msg, 502)
+    return JSONResponse({"grain": grain, "rows": [summarize(row) for row in rows]})
+
+app = Starlette(
+    routes=[
+        Route("/api/followhour/series", series_endpoint),
+        Route("/api/followhour/rollups", rollups_endpoint),
+        Route("/api/{table}/rows", rows_endpoint),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=ALLOWED_ORIGINS, allow_headers=["Authorization"])],
+)
+
+if __name__ == "__main__":
+    import uvicorn
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    uvicorn.run(app, host=os.getenv("API_HOST", "127.0.0.1"), port=int(os.getenv("API_PORT", "8000")))
@@ -0,0 +1,226 @@
+import io
+import time
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytz
+import matplotlib.dates as mdates
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from queries import iter_chunks, parse_timestamp
+from rollups import DEFAULT_DEVICE_ID, fetch_rollups, summarize
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+POINT_BUDGET = 600                  # points drawn per series, whatever the range
+RAW_MAX_SPAN = timedelta(days=3)    # longer ranges are drawn from rollups
+HOURLY_MAX_SPAN = timedelta(days=40)  # beyond this, daily rollups keep the row count under 1000
+CACHE_SIZE = 128
+CACHE_TTL = 300                     # seconds, for ranges that are still growing
+RANGE_HELP = "24h, 7d, 2023-01-15 or 2023-01-01..2023-01-31"
+
+# --- RANGE PARSING ---
+def parse_range(text: str, timezone: str = 'Asia/Ho_Chi_Minh'):
+    """Parses a chart range into (start, end) aware datetimes in the given timezone.
+
+    Accepts a relative span (`24h`, `7d`), a single local day (`YYYY-MM-DD`) or
+    an inclusive local day range (`YYYY-MM-DD..YYYY-MM-DD`). Every invalid
+    input, including spans outside the datetime range, raises ValueError.
+    """
+    tz = pytz.timezone(timezone)
+    text = text.strip().lower()
+    try:
+        if text[:-1].isdigit() and text[-1:] in ("h", "d"):
+            amount = int(text[:-1])
+            if amount <= 0:
+                raise ValueError("Range must be positive.")
+            span = timedelta(hours=amount) if text[-1] == "h" else timedelta(days=amount)
+            end = datetime.now(tz)
+            return end - span, end
+        first, _, last = text.partition("..")
+        start_day = datetime.strptime(first, '%Y-%m-%d')
+        end_day = datetime.strptime(last, '%Y-%m-%d') if last else start_day
+        if end_day < start_day:
+            raise ValueError("Range end is before its start.")
+        return tz.localize(start_day), tz.localize(end_day + timedelta(days=1))
+    except OverflowError:
+        raise ValueError("Range is out of bounds.") from None
+
+# --- DOWNSAMPLING ---
+def minmax_downsample(x: np.ndarray, y: np.ndarray, budget: int = POINT_BUDGET):
+    """Keeps the min and max point of each of budget/2 equal-count buckets.
+
+    Spikes survive (unlike averaging) and the output never exceeds `budget`
+    points, so drawing cost is independent of the input length.
+    """
+    n = len(x)
+    if n <= budget:
+        return x, y
+    buckets = budget // 2
+    bucket = (np.arange(n) * buckets) // n
+    starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+    keep = np.zeros(n, dtype=bool)
+    for reduce in (np.minimum, np.maximum):
+        extreme = reduce.reduceat(y, starts)
+        hits = np.flatnonzero(y == extreme[bucket])
+        _, first = np.unique(bucket[hits], return_index=True)
+        keep[hits[first]] = True
+    return x[keep], y[keep]
+
+def envelope_downsample(x: np.ndarray, low: np.ndarray, high: np.ndarray, budget: int = POINT_BUDGET):
+    """Merges a min/max band into at most `budget` equal-count buckets."""
+    n = len(x)
+    if n <= budget:
+        return x, low, high
+    starts = np.flatnonzero(np.r_[True, np.diff((np.arange(n) * budget) // n) != 0])
+    return x[starts], np.minimum.reduceat(low, starts), np.maximum.reduceat(high, starts)
+
+# --- DATA ---
+def _fetch_raw(client, device_id: str, start: datetime, end: datetime):
+    times, bpm, temp = [], [], []
+    for rows in iter_chunks(client, "followhour", columns="id,time,bpm_avg,temperature", chunk_size=5000,
+                            start=start.isoformat(), end=end.isoformat(), filters={"device_id": device_id}):
+        for row in rows:
+            if row.get("bpm_avg") is None or row.get("temperature") is None:
+                continue
+            times.append(parse_timestamp(row["time"]).timestamp())
+            bpm.append(row["bpm_avg"])
+            temp.append(row["temperature"])
+    return np.array(times), np.array(bpm, dtype=float), np.array(temp, dtype=float)
+
+def _fetch_rollup(client, device_id: str, start: datetime, end: datetime):
+    grain = "hour" if end - start <= HOURLY_MAX_SPAN else "day"
+    rows, error = fetch_rollups(client, grain, start=start.isoformat(), end=end.isoformat(), device_id=device_id)
+    if error:
+        raise RuntimeError(error)
+    summaries = [summarize(row) for row in rows]
+    offset = 1800 if grain == "hour" else 43200
+    times = np.array([parse_timestamp(s["bucket"]).timestamp() + offset for s in summaries])
+    series = {}
+    for prefix in ("bpm", "temp"):
+        series[prefix] = np.array([[s[f"{prefix}_mean"], s[f"{prefix}_min"], s[f"{prefix}_max"]] for s in summaries],
+                                  dtype=float).reshape(-1, 3)
+    return times, series["bpm"], series["temp"]
+
+# --- SERIES ---
+def load_series(client, start: datetime, end: datetime, device_id: str = DEFAULT_DEVICE_ID, budget: int = POINT_BUDGET):
+    """Loads BPM and temperature over [start, end), downsampled to `budget` points per series.
+
+    Returns None if there is no data. Each series holds epoch-second times `t`
+    and `value`; series built from rollups also carry a min/max band.
+    """
+    if end - start > RAW_MAX_SPAN:
+        source = "hour" if end - start <= HOURLY_MAX_SPAN else "day"
+        times, bpm, temp = _fetch_rollup(client, device_id, start, end)
+    else:
+        source = "raw"
+        times, bpm, temp = _fetch_raw(client, device_id, start, end)
+    if len(times) == 0:
+        return None
+
+    series = {}
+    for name, values in (("bpm", bpm), ("temperature", temp)):
+        if source == "raw":
+            t, value = minmax_downsample(times, values, budget)
+            series[name] = {"t": t, "value": value}
+        else:
+            t, value = minmax_downsample(times, values[:, 0], budget)
+            band_t, low, high = envelope_downsample(times, values[:, 1], values[:, 2], budget)
+            series[name] = {"t": t, "value": value, "band_t": band_t, "low": low, "high": high}
+    return {"source": source, "series": series}
+
+# --- RENDERING ---
+def render_chart(data: dict, start: datetime, end: datetime, timezone: str = 'Asia/Ho_Chi_Minh') -> bytes:
+    """Renders a loaded series as PNG bytes.
+
+    Uses a standalone Figure on an Agg canvas rather than pyplot, whose global
+    figure manager is not thread-safe; charts are rendered in worker threads.
+    """
+    tz = pytz.timezone(timezone)
+    fig = Figure(figsize=(8, 5), dpi=100)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(2, 1, sharex=True)
+    for ax, name, label, color in ((axes[0], "bpm", "BPM", "tab:red"), (axes[1], "temperature", "Temperature (°C)", "tab:blue")):
+        series = data["series"][name]
+        if "band_t" in series:
+            ax.fill_between(_to_dates(series["band_t"], tz), series["low"], series["high"], color=color, alpha=0.2, linewidth=0)
+        ax.plot(_to_dates(series["t"], tz), series["value"], color=color, linewidth=1)
+        ax.set_ylabel(label)
+        ax.grid(True, alpha=0.3)
+    axes[1].xaxis.set_major_formatter(mdates.ConciseDateFormatter(axes[1].xaxis.get_major_locator(), tz=tz))
+    axes[0].set_title(f"{start.astimezone(tz):%Y-%m-%d %H:%M} – {end.astimezone(tz):%Y-%m-%d %H:%M} ({timezone})")
+    fig.tight_layout()
+
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+def _to_dates(epoch_seconds: np.ndarray, tz):
+    return [datetime.fromtimestamp(t, tz) for t in epoch_seconds]
+
+# --- CACHE ---
+class RangeCache:
+    """LRU of values computed for a (device, range) key.
+
+    Ranges that end in the past never change and are kept until evicted;
+    ranges reaching into the present expire after `ttl` seconds. Safe to share
+    between threads.
+    """
+
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.size = size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires is not None and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, end: datetime):
+        expires = time.time() + self.ttl if end.timestamp() > time.time() else None
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+def range_cache_key(device_id: str, range_text: str, timezone: str, end: datetime, *extra) -> tuple:
+    # Relative ranges move every second; snap them to the TTL so repeats hit the cache.
+    return (device_id, range_text.strip().lower(), timezone, int(end.timestamp()) // CACHE_TTL, *extra)
+
+chart_cache = RangeCache()
+
+def get_chart(client, range_text: str, timezone: str = 'Asia/Ho_Chi_Minh', device_id: str = DEFAULT_DEVICE_ID):
+    """Returns (png, error) for a user-entered range, rendering only on cache misses."""
+    try:
+        start, end = parse_range(range_text, timezone)
+    except ValueError:
+        return None, f"Invalid range. Please use one of: {RANGE_HELP}."
+    key = range_cache_key(device_id, range_text, timezone, end)
+    png = chart_cache.get(key)
+    if png is not None:
+        return png, None
+    try:
+        data = load_series(client, start, end, device_id)
+        if data is None:
+            return None, "No records found in followhour for this range."
+        png = render_chart(data, start, end, timezone)
+    except Exception as e:
+        logger.error(f"Error rendering chart for {range_text}: {e}")
+        return None, "An error occurred while rendering the chart."
+    chart_cache.put(key, png, end)
+    return png, None
@@ -0,0 +1,177 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+LAG_THRESHOLD = 0.25        # seconds the event loop may be blocked before it is reported
+LAG_CHECK_INTERVAL = 0.05
+PROFILE_INTERVAL = 0.005    # seconds between stack samples
+MAX_PROFILE_SECONDS = 30
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+# The bot's own modules: .py files directly in PROJECT_DIR, not in subdirectories such as a virtualenv.
+PROJECT_FILES = {os.path.join(PROJECT_DIR, name) for name in os.listdir(PROJECT_DIR) if name.endswith(".py")}
+PROJECT_NAMES = {os.path.basename(path) for path in PROJECT_FILES}
+
+@lru_cache(maxsize=None)
+def _is_project_file(filename: str) -> bool:
+    return os.path.abspath(filename) in PROJECT_FILES
+
+def _frame_label(frame) -> str:
+    """Labels bot frames `main.py:func` and all others `parent/file.py:func`.
+
+    Only bot frames get a bare file name, so a label alone tells them apart
+    from a library module that happens to be called main.py or api.py.
+    """
+    code = frame.f_code
+    if _is_project_file(code.co_filename):
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+    parent, name = os.path.split(code.co_filename)
+    return f"{os.path.basename(parent)}/{name}:{code.co_name}"
+
+def _is_project_label(label: str) -> bool:
+    return label.split(":")[0] in PROJECT_NAMES
+
+def _project_function(stack: list) -> str:
+    """Returns the innermost bot function in a stack, i.e. the handler at fault."""
+    for frame in reversed(stack):
+        if _is_project_file(frame.f_code.co_filename):
+            return _frame_label(frame)
+    return _frame_label(stack[-1]) if stack else "unknown"
+
+def _thread_stack(thread_id: int) -> list:
+    frame = sys._current_frames().get(thread_id)
+    stack = []
+    while frame is not None:
+        stack.append(frame)
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+# --- EVENT LOOP LAG MONITOR ---
+class LoopLagMonitor:
+    """Detects a blocked event loop and logs what it was running at the time.
+
+    A coroutine on the loop records a heartbeat; a watchdog thread notices when
+    the heartbeat stops and samples the loop thread's stack. Nothing is added
+    to the loop's hot path, so it is cheap enough to leave on in production.
+    """
+
+    def __init__(self, threshold: float = LAG_THRESHOLD, interval: float = LAG_CHECK_INTERVAL):
+        self.threshold = threshold
+        self.interval = interval
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._beat = time.monotonic()
+        self._loop_thread_id = None
+        self._running = False
+
+    def start(self):
+        """Starts monitoring the running loop. Must be called from a coroutine on it."""
+        if self._running:
+            return
+        self._running = True
+        self._loop_thread_id = threading.get_ident()
+        asyncio.get_running_loop().create_task(self._heartbeat(), name="loop_lag_heartbeat")
+        threading.Thread(target=self._watch, name="loop_lag_watchdog", daemon=True).start()
+
+    def stop(self):
+        self._running = False
+
+    async def _heartbeat(self):
+        while self._running:
+            self._beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        reported_at = None
+        culprit = None
+        while self._running:
+            time.sleep(self.interval)
+            beat = self._beat
+            lag = time.monotonic() - beat - self.interval
+            if lag > self.threshold and reported_at != beat:
+                reported_at = beat
+                stack = _thread_stack(self._loop_thread_id)
+                culprit = _project_function(stack)
+                self.stalls += 1
+                trace = "".join(traceback.format_list(traceback.extract_stack(stack[-1])[-8:])) if stack else ""
+                logger.warning(f"Event loop blocked for {lag:.2f}s in {culprit}:\n{trace}")
+            elif reported_at is not None and reported_at != beat:
+                stall = beat - reported_at - self.interval
+                self.max_lag = max(self.max_lag, stall)
+                logger.warning(f"Event loop was blocked for {stall:.2f}s in total by {culprit}.")
+                reported_at = None
+
+    def summary(self) -> str:
+        return f"Loop stalls over {self.threshold}s: {self.stalls}, longest: {self.max_lag:.2f}s"
+
+# --- SAMPLING PROFILER ---
+def _sample(thread_id: int, seconds: float, interval: float, counts: Counter, stop: threading.Event):
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline and not stop.is_set():
+        stack = _thread_stack(thread_id)
+        if stack:
+            counts[";".join(_frame_label(frame) for frame in stack)] += 1
+        time.sleep(interval)
+
+async def sample_profile(seconds: float, interval: float = PROFILE_INTERVAL) -> Counter:
+    """Samples the event loop thread's stack for `seconds` without blocking the loop.
+
+    Returns collapsed stacks ("a;b;c" -> samples), the input format of
+    flamegraph.pl and speedscope.
+    """
+    seconds = min(max(seconds, 1), MAX_PROFILE_SECONDS)
+    counts = Counter()
+    stop = threading.Event()
+    sampler = threading.Thread(target=_sample, args=(threading.get_ident(), seconds, interval, counts, stop),
+                               name="profile_sampler", daemon=True)
+    sampler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        stop.set()
+        await asyncio.to_thread(sampler.join)
+    return counts
+
+def top_functions(counts: Counter, limit: int = 15) -> str:
+    """Summarizes collapsed stacks by innermost bot function (self time)."""
+    total = sum(counts.values())
+    if not total:
+        return "No samples collected."
+    by_function = Counter()
+    for stack, n in counts.items():
+        frames = stack.split(";")
+        project = [f for f in frames if _is_project_label(f)]
+        label = frames[-1] if not project or project[-1] == frames[-1] else f"{project[-1]} -> {frames[-1]}"
+        by_function[label] += n
+    lines = [f"{n / total:6.1%}  {label}" for label, n in by_function.most_common(limit)]
+    return f"{total} samples\n" + "\n".join(lines)
+
+def collapsed_stacks(counts: Counter) -> bytes:
+    return "".join(f"{stack} {n}\n" for stack, n in counts.most_common()).encode()
+
+# --- TASK AND JOB DUMPS ---
+def dump_tasks() -> str:
+    """Lists pending asyncio tasks with the line each one is suspended at."""
+    lines = []
+    for task in asyncio.all_tasks():
+        frames = task.get_stack(limit=1)
+        where = f"{os.path.basename(frames[0].f_code.co_filename)}:{frames[0].f_lineno}" if frames else "not started"
+        lines.append(f"{task.get_name()}: {task.get_coro().__qualname__} at {where}")
+    return f"{len(lines)} pending tasks\n" + "\n".join(sorted(lines))
+
+def dump_jobs(job_queue) -> str:
+    """Lists scheduled JobQueue jobs and when they next run."""
+    lines = []
+    for job in job_queue.jobs():
+        next_t = job.next_t.strftime("%Y-%m-%d %H:%M:%S %Z") if job.next_t else "paused"
+        lines.append(f"{job.name}: next at {next_t}")
+    return f"{len(lines)} scheduled jobs\n" + "\n".join(sorted(lines))
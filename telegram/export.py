@@ -0,0 +1,152 @@
+import os
+import csv
+import gzip
+import time
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta, timezone
+
+from queries import iter_chunks, time_column_for
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+EXPORT_FORMATS = ("csv", "parquet")
+EXPORT_CHUNK_SIZE = 5000
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024  # Telegram bot upload limit
+
+def export_columns(table_name: str) -> list:
+    columns = ["id", time_column_for(table_name), "bpm_avg", "temperature"]
+    # onetest rows are not linked to a device (see sql/002).
+    return columns + ["device_id"] if table_name == "followhour" else columns
+
+# --- WRITERS ---
+def write_csv_gz(chunks, path: str, columns: list) -> int:
+    """Writes chunks of row dicts to a gzip-compressed CSV, one chunk in memory at a time."""
+    rows_written = 0
+    with gzip.open(path, "wt", newline="", compresslevel=6) as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for rows in chunks:
+            writer.writerows([row.get(column) for column in columns] for row in rows)
+            rows_written += len(rows)
+    return rows_written
+
+def write_parquet(chunks, path: str, columns: list) -> int:
+    """Writes chunks of row dicts to a zstd-compressed Parquet file, one row group per chunk."""
+    try:
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise RuntimeError("Parquet export requires the optional pyarrow package (pip install pyarrow).")
+
+    time_column = columns[1]
+    fields = [
+        ("id", pa.int64()),
+        (time_column, pa.timestamp("us", tz="UTC")),
+        ("bpm_avg", pa.float64()),
+        ("temperature", pa.float64()),
+    ]
+    if "device_id" in columns:
+        fields.append(("device_id", pa.string()))
+    schema = pa.schema(fields)
+    rows_written = 0
+    with pq.ParquetWriter(path, schema, compression="zstd") as writer:
+        for rows in chunks:
+            arrays = [
+                pa.array([row["id"] for row in rows], pa.int64()),
+                pc.cast(pa.array([row[time_column] for row in rows], pa.string()), schema.field(time_column).type),
+                pa.array([row.get("bpm_avg") for row in rows], pa.float64()),
+                pa.array([row.get("temperature") for row in rows], pa.float64()),
+            ]
+            if "device_id" in columns:
+                arrays.append(pa.array([row.get("device_id") for row in rows], pa.string()))
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            rows_written += len(rows)
+    return rows_written
+
+WRITERS = {
+    "csv": (write_csv_gz, ".csv.gz"),
+    "parquet": (write_parquet, ".parquet"),
+}
+
+# --- EXPORT ---
+def _size_limited(chunks, path: str, max_size: int):
+    """Passes chunks through, stopping the export once the file written so far exceeds `max_size`."""
+    for rows in chunks:
+        yield rows
+        if os.path.getsize(path) > max_size:
+            raise RuntimeError(f"The export is larger than the {max_size // (1024 * 1024)} MB limit. "
+                               f"Please use the web dashboard.")
+
+def export_table(client, table_name: str, fmt: str = "csv", directory: str = None, chunk_size: int = EXPORT_CHUNK_SIZE,
+                 max_size: int = None, device_ids: list = None):
+    """Streams a table into a compressed file and returns (path, rows, error).
+
+    Rows are read with keyset pagination so memory stays bounded by one chunk
+    whatever the table size. With `device_ids`, only those devices' readings
+    are exported. With `max_size`, the file is checked after every chunk so an
+    oversized export stops early instead of reading the whole table. The
+    caller owns (and should delete) the file.
+    """
+    if fmt not in WRITERS:
+        return None, 0, f"Unknown export format. Please use one of: {', '.join(EXPORT_FORMATS)}."
+    writer, suffix = WRITERS[fmt]
+    columns = export_columns(table_name)
+    fd, path = tempfile.mkstemp(prefix=f"{table_name}_", suffix=suffix, dir=directory)
+    os.close(fd)
+    try:
+        filters = None if device_ids is None else {"device_id": list(device_ids)}
+        chunks = iter_chunks(client, table_name, columns=",".join(columns), chunk_size=chunk_size, filters=filters)
+        if max_size is not None:
+            chunks = _size_limited(chunks, path, max_size)
+        rows = writer(chunks, path, columns)
+    except RuntimeError as e:
+        os.remove(path)
+        return None, 0, str(e)
+    except Exception as e:
+        os.remove(path)
+        logger.error(f"Error exporting {table_name} as {fmt}: {e}")
+        return None, 0, "An error occurred while exporting data."
+    return path, rows, None
+
+# --- BENCHMARK ---
+def _synthetic_chunks(total: int, chunk_size: int, time_column: str, timings: list):
+    """Yields fake pages, recording the time spent building them so it can be excluded."""
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    for offset in range(0, total, chunk_size):
+        started = time.perf_counter()
+        rows = [
+            {"id": i, time_column: (start + timedelta(seconds=15 * i)).isoformat(),
+             "bpm_avg": 60 + i % 40, "temperature": 36 + (i % 20) / 10}
+            for i in range(offset, min(offset + chunk_size, total))
+        ]
+        timings.append(time.perf_counter() - started)
+        yield rows
+
+def benchmark(rows: int = 2_000_000, chunk_size: int = EXPORT_CHUNK_SIZE):
+    """Measures writer throughput on synthetic followhour pages (database time excluded)."""
+    columns = export_columns("followhour")
+    for fmt, (writer, suffix) in WRITERS.items():
+        fd, path = tempfile.mkstemp(suffix=suffix)
+        os.close(fd)
+        try:
+            timings = []
+            started = time.perf_counter()
+            written = writer(_synthetic_chunks(rows, chunk_size, columns[1], timings), path, columns)
+            elapsed = time.perf_counter() - started - sum(timings)
+            print(f"{fmt}: {written:,} rows in {elapsed:.2f}s ({written / elapsed:,.0f} rows/s), "
+                  f"{os.path.getsize(path) / 1024 / 1024:.1f} MiB")
+        except RuntimeError as e:
+            print(f"{fmt}: skipped ({e})")
+        finally:
+            os.remove(path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the export writers.")
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+    args = parser.parse_args()
+    benchmark(rows=args.rows, chunk_size=args.chunk_size)
@@ -13,11 +13,25 @@ from telegram.ext import (
     CallbackContext,
     CallbackQueryHandler,
     ConversationHandler,
+    TypeHandler,
 )
 from supabase import create_client, Client
 import pytz
 import time
 from aiolimiter import AsyncLimiter
+from anomaly import AnomalyDetector, detect_anomalies
+from charts import RANGE_HELP, get_chart, parse_range
+from diagnostics import (
+    MAX_PROFILE_SECONDS,
+    LoopLagMonitor,
+    collapsed_stacks,
+    dump_jobs,
+    dump_tasks,
+    sample_profile,
+    top_functions,
+)
+from export import EXPORT_FORMATS, MAX_DOCUMENT_SIZE, export_table
+from sessions import CONVERSATION_TIMEOUT, SESSION_EVICT_INTERVAL, SessionStore
 
 # Load environment variables
 load_dotenv()
@@ -28,6 +42,8 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 ID_MAPPING_FILE = "id_mapping.json"
 TIMER_FILE = "timer.json"
+READING_POLL_INTERVAL = 15  # seconds, matches the ESP32 followhour cadence
+READING_POLL_PAGE_SIZE = 1000
 
 # Validate environment variables
 if not all([TELEGRAM_TOKEN, SUPABASE_URL, SUPABASE_KEY]):
@@ -58,10 +74,15 @@ def init_supabase():
 
 supabase: Client = init_supabase()
 rate_limiter = AsyncLimiter(20, 1)  # 20 req/s
+anomaly_detector = AnomalyDetector()
+sessions = SessionStore()
+lag_monitor = LoopLagMonitor()
 
 # --- CONVERSATION STATES ---
 GET_USER_ID_DATA, CHOOSE_TABLE, CHOOSE_ACTION, CHOOSE_RECORDS_LATEST, GET_FILTER_VALUE = range(5)
 GET_USER_ID_TIMER, GET_MINUTES, CHOOSE_REPEAT, CHOOSE_TABLE_TIMER, CHOOSE_ACTION_TIMER, CHOOSE_RECORDS_LATEST_TIMER, GET_FILTER_VALUE_TIMER = range(5, 12)
+GET_CHART_RANGE, GET_CHART_RANGE_TIMER = range(12, 14)
+DATA_FLOW, TIMER_FLOW = "data", "timer"  # session keys, one session per flow, chat and user
 
 # --- HELPER FUNCTIONS ---
 def load_json_file(filename: str):
@@ -115,6 +136,18 @@ async def get_user_profile_by_id(user_id: str):
         logger.error(f"Error fetching user profile for id {user_id}: {e}")
         return None, "An error occurred while fetching your profile."
 
+async def get_profile_device_ids(profile_id: str):
+    """Returns the ids of the devices linked to a profile (sql/003)."""
+    if not supabase:
+        return None, "Supabase connection not available."
+    try:
+        async with rate_limiter:
+            rows = supabase.table("devices").select("device_id").eq("profile_id", profile_id).execute().data
+        return [row["device_id"] for row in rows], None
+    except Exception as e:
+        logger.error(f"Error fetching devices for profile {profile_id}: {e}")
+        return None, "An error occurred while fetching your devices."
+
 # --- DATA FETCHING AND FORMATTING HELPERS ---
 def _format_record(record: dict, table_name: str, timezone: str = 'Asia/Ho_Chi_Minh') -> str:
     """Formats a single record into a human-readable string."""
@@ -144,6 +177,14 @@ def _format_record(record: dict, table_name: str, timezone: str = 'Asia/Ho_Chi_M
         return f"Time: {formatted_time}\nBPM: {bpm}\nTemperature: {temp}°C"
     return "Unknown table format."
 
+def _parse_day_range(value: str):
+    """Parses 'YYYY-MM-DD' or 'YYYY-MM-DD..YYYY-MM-DD' into inclusive (first, last) day strings."""
+    first, _, last = value.strip().partition('..')
+    first, last = first.strip(), (last or first).strip()
+    if datetime.strptime(first, '%Y-%m-%d') > datetime.strptime(last, '%Y-%m-%d'):
+        raise ValueError("Start day is after end day.")
+    return first, last
+
 async def _fetch_data_from_supabase(table_name: str, limit: int = None, filter_field: str = None, filter_value: str = None):
     """Generic function to fetch data from Supabase with optional limits and filters."""
     if not supabase:
@@ -164,13 +205,15 @@ async def _fetch_data_from_supabase(table_name: str, limit: int = None, filter_f
             # Filtering
             if filter_field and filter_value:
                 if filter_field == "date":
+                    # local_day is the reading's calendar day in the device's timezone (sql/002), indexed.
                     try:
-                        datetime.strptime(filter_value, '%Y-%m-%d')
-                        start_of_day = f"{filter_value}T00:00:00+00:00"
-                        end_of_day = f"{filter_value}T23:59:59+00:00"
-                        query = query.gte("time", start_of_day).lte("time", end_of_day)
+                        first_day, last_day = _parse_day_range(filter_value)
                     except ValueError:
-                        return None, "Invalid date format. Please use YYYY-MM-DD."
+                        return None, "Invalid date format. Please use YYYY-MM-DD or YYYY-MM-DD..YYYY-MM-DD."
+                    if first_day == last_day:
+                        query = query.eq("local_day", first_day)
+                    else:
+                        query = query.gte("local_day", first_day).lte("local_day", last_day)
                 elif filter_field in ["bpm_avg", "temperature"]:
                     try:
                         low, high = map(float, filter_value.split('-'))
@@ -194,9 +237,11 @@ async def _fetch_data_from_supabase(table_name: str, limit: int = None, filter_f
 
 async def show_last_record(update: Update, context: CallbackContext) -> int:
     """Fetches and displays the last record from the chosen table."""
-    table_choice = context.user_data.get('table_choice')
-    profile = context.user_data.get('profile', {})
-    timezone = profile.get('timezone', 'Asia/Ho_Chi_Minh')
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    if session is None:
+        return await _session_expired(update, "data")
+    table_choice = session.table_choice
+    timezone = session.timezone
 
     if not table_choice:
         await (update.callback_query or update.message).reply_text("Error: Table choice not found. Please restart with /data.")
@@ -221,17 +266,17 @@ async def show_last_record(update: Update, context: CallbackContext) -> int:
         else:
             await update.message.reply_text(f"No records found in {table_choice}.")
 
-    keys_to_clear = ['table_choice', 'limit', 'filter_field', 'filter_value']
-    for key in keys_to_clear:
-        context.user_data.pop(key, None)
+    sessions.discard(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
     return ConversationHandler.END
 
 async def show_latest_records(update: Update, context: CallbackContext) -> int:
     """Fetches and displays the latest N records from the chosen table."""
-    table_choice = context.user_data.get('table_choice')
-    limit = context.user_data.get('limit')
-    profile = context.user_data.get('profile', {})
-    timezone = profile.get('timezone', 'Asia/Ho_Chi_Minh')
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    if session is None:
+        return await _session_expired(update, "data")
+    table_choice = session.table_choice
+    limit = session.limit
+    timezone = session.timezone
 
     if not table_choice or not limit:
         await (update.callback_query or update.message).reply_text("Error: Table or limit not found. Please restart with /data.")
@@ -258,18 +303,18 @@ async def show_latest_records(update: Update, context: CallbackContext) -> int:
         else:
             await update.message.reply_text(f"No records found in {table_choice}.")
 
-    keys_to_clear = ['table_choice', 'limit', 'filter_field', 'filter_value']
-    for key in keys_to_clear:
-        context.user_data.pop(key, None)
+    sessions.discard(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
     return ConversationHandler.END
 
 async def received_filter_value(update: Update, context: CallbackContext) -> int:
     """Handles the filter value input and fetches/displays filtered records."""
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    if session is None:
+        return await _session_expired(update, "data")
     filter_value = update.message.text
-    table_choice = context.user_data.get('table_choice')
-    filter_field = context.user_data.get('filter_field')
-    profile = context.user_data.get('profile', {})
-    timezone = profile.get('timezone', 'Asia/Ho_Chi_Minh')
+    table_choice = session.table_choice
+    filter_field = session.filter_field
+    timezone = session.timezone
 
     if not table_choice or not filter_field:
         await update.message.reply_text("Error: Missing context for filtering. Please restart with /data.")
@@ -287,10 +332,10 @@ async def received_filter_value(update: Update, context: CallbackContext) -> int
             return GET_FILTER_VALUE
     elif filter_field == 'date':
         try:
-            datetime.strptime(filter_value, '%Y-%m-%d')
-            parsed_filter_value = filter_value
+            first_day, last_day = _parse_day_range(filter_value)
+            parsed_filter_value = first_day if first_day == last_day else f"{first_day}..{last_day}"
         except ValueError:
-            await update.message.reply_text("Invalid date format. Please use YYYY-MM-DD (e.g., 2023-01-15).")
+            await update.message.reply_text("Invalid date format. Please use YYYY-MM-DD or YYYY-MM-DD..YYYY-MM-DD (e.g., 2023-01-15 or 2023-01-01..2023-01-07).")
             return GET_FILTER_VALUE
     else:
         parsed_filter_value = filter_value
@@ -307,9 +352,32 @@ async def received_filter_value(update: Update, context: CallbackContext) -> int
     else:
         await update.message.reply_text(f"No records found in {table_choice} for the given filter.")
 
-    keys_to_clear = ['table_choice', 'limit', 'filter_field', 'filter_value']
-    for key in keys_to_clear:
-        context.user_data.pop(key, None)
+    sessions.discard(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    return ConversationHandler.END
+
+async def received_chart_range(update: Update, context: CallbackContext) -> int:
+    """Renders the chosen range of followhour data as a chart."""
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    if session is None:
+        return await _session_expired(update, "data")
+    range_text = update.message.text
+    timezone = session.timezone
+
+    try:
+        parse_range(range_text, timezone)
+    except ValueError:
+        await update.message.reply_text(f"Invalid range. Please use one of: {RANGE_HELP}.")
+        return GET_CHART_RANGE
+
+    async with rate_limiter:
+        png, error_msg = await asyncio.to_thread(get_chart, supabase, range_text, timezone)
+
+    if error_msg:
+        await update.message.reply_text(error_msg)
+    else:
+        await update.message.reply_photo(png, caption=f"followhour data for {range_text}")
+
+    sessions.discard(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
     return ConversationHandler.END
 
 # --- TIMER FUNCTIONS ---
@@ -432,6 +500,14 @@ async def timer_callback(context: CallbackContext):
             await context.bot.send_message(chat_id, response_text)
         else:
             await context.bot.send_message(chat_id, f"No records found in {table} for the given filter.")
+    elif mode == 'chart':
+        chart_range = config['chart_range']
+        async with rate_limiter:
+            png, error_msg = await asyncio.to_thread(get_chart, supabase, chart_range, timezone)
+        if error_msg:
+            await context.bot.send_message(chat_id, error_msg)
+        else:
+            await context.bot.send_photo(chat_id, png, caption=f"Timer triggered! followhour data for {chart_range}")
     if config.get('timer_type') == 'one-time':
         clear_timer_json(chat_id)
 
@@ -450,22 +526,27 @@ async def clear_timer(update: Update, context: CallbackContext):
 
 async def do_schedule(update: Update, context: CallbackContext) -> int:
     chat_id = update.effective_chat.id
+    session = sessions.get(chat_id, update.effective_user.id, TIMER_FLOW)
+    if session is None:
+        return await _session_expired(update, "settimer")
     current_jobs = context.job_queue.get_jobs_by_name(f"timer_{chat_id}")
     for job in current_jobs:
         job.schedule_removal()
     clear_timer_json(chat_id)
-    mode = context.user_data['mode']
-    table_choice = context.user_data['table_choice']
-    config = {'mode': mode, 'table': table_choice, 'timer_type': context.user_data['timer_type']}
+    mode = session.mode
+    table_choice = session.table_choice
+    config = {'mode': mode, 'table': table_choice, 'timer_type': session.timer_type}
     if mode == 'latest':
-        config['limit'] = context.user_data['limit']
+        config['limit'] = session.limit
     elif mode == 'filter':
-        config['filter_field'] = context.user_data['filter_field']
-        config['filter_value'] = context.user_data['filter_value']
-    minutes = context.user_data['minutes']
+        config['filter_field'] = session.filter_field
+        config['filter_value'] = session.filter_value
+    elif mode == 'chart':
+        config['chart_range'] = session.chart_range
+    minutes = session.minutes
     interval = minutes * 60
     set_time = time.time()
-    timer_type = context.user_data['timer_type']
+    timer_type = session.timer_type
     if timer_type == 'one-time':
         due_time = set_time + interval
         context.job_queue.run_once(timer_callback, interval, chat_id=chat_id, name=f"timer_{chat_id}", data=config)
@@ -476,20 +557,90 @@ async def do_schedule(update: Update, context: CallbackContext) -> int:
         context.job_queue.run_repeating(timer_callback, interval, first=interval, chat_id=chat_id, name=f"timer_{chat_id}", data=config)
         save_timer(chat_id, {'type': 'repeating', 'first_due': first_due, 'interval': interval, 'config': config})
         await update.message.reply_text(f"Repeating timer set every {minutes} minutes to fetch {table_choice} data.")
-    keys_to_clear = ['minutes', 'timer_type', 'table_choice', 'mode', 'limit', 'filter_field', 'filter_value', 'profile']
-    for key in keys_to_clear:
-        context.user_data.pop(key, None)
+    sessions.discard(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
     return ConversationHandler.END
 
+# --- ANOMALY NOTIFICATIONS ---
+def _format_anomaly(anomaly, record: dict, timezone: str) -> str:
+    label = "BPM" if anomaly.metric == "bpm_avg" else "Temperature"
+    direction = "above" if anomaly.z > 0 else "below"
+    return (
+        f"⚠️ Unusual {label} reading ({direction} your usual {anomaly.mean}):\n"
+        f"{_format_record(record, 'followhour', timezone)}"
+    )
+
+async def _send_anomaly_alerts(context: CallbackContext, alerts: list):
+    """Sends each alert only to the chats of the profile that owns the device (sql/003)."""
+    device_ids = sorted({anomaly.key for anomaly, _ in alerts})
+    async with rate_limiter:
+        try:
+            owners = supabase.table("devices").select("device_id,profile_id").in_("device_id", device_ids).execute().data
+        except Exception as e:
+            logger.error(f"Error fetching device owners: {e}")
+            return
+    owner_of = {row["device_id"]: row["profile_id"] for row in owners if row.get("profile_id")}
+    chats_of = {}
+    for telegram_id, profile_id in load_id_mapping().items():
+        chats_of.setdefault(profile_id, []).append(telegram_id)
+
+    profiles = {}
+    for anomaly, record in alerts:
+        profile_id = owner_of.get(anomaly.key)
+        if profile_id is None:
+            logger.info(f"Anomaly on device {anomaly.key} has no owner to notify.")
+            continue
+        if profile_id not in profiles:
+            profiles[profile_id], _ = await get_user_profile_by_id(profile_id)
+        profile = profiles[profile_id]
+        if not profile or profile.get("status") != "approved":
+            continue
+        timezone = profile.get('timezone', 'Asia/Ho_Chi_Minh')
+        for telegram_id in chats_of.get(profile_id, []):
+            try:
+                await context.bot.send_message(int(telegram_id), _format_anomaly(anomaly, record, timezone))
+            except Exception as e:
+                logger.warning(f"Could not send anomaly alert to {telegram_id}: {e}")
+
+async def poll_new_readings(context: CallbackContext):
+    """Feeds followhour rows inserted since the last poll to the anomaly detector.
+
+    The cursor is the identity column, not `time`: the device stamps `time`
+    itself, so a late POST can carry a time a time-based cursor has passed.
+    """
+    if not supabase:
+        return
+    cursor = context.bot_data.get('reading_cursor')
+    while True:
+        async with rate_limiter:
+            try:
+                if cursor is None:
+                    # Start from the newest reading instead of replaying history.
+                    latest = supabase.table("followhour").select("id").order("id", desc=True).limit(1).execute().data
+                    context.bot_data['reading_cursor'] = latest[0]["id"] if latest else 0
+                    return
+                rows = (supabase.table("followhour").select("*").gt("id", cursor)
+                        .order("id").limit(READING_POLL_PAGE_SIZE).execute().data)
+            except Exception as e:
+                logger.error(f"Error polling new readings: {e}")
+                return
+        # Only an empty page means we are caught up; PostgREST may cap pages below the limit.
+        if not rows:
+            return
+        cursor = context.bot_data['reading_cursor'] = rows[-1]["id"]
+        alerts = detect_anomalies(anomaly_detector, rows)
+        if alerts:
+            await _send_anomaly_alerts(context, alerts)
+
 # --- TIMER CONVERSATION HANDLERS ---
 async def settimer_start(update: Update, context: CallbackContext) -> int:
+    session = sessions.start(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
     telegram_id = update.effective_user.id
     id_mapping = load_id_mapping()
     cached_profile_id = id_mapping.get(str(telegram_id))
     if cached_profile_id:
         profile, error_msg = await get_user_profile_by_id(cached_profile_id)
         if profile:
-            context.user_data['profile'] = profile
+            session.set_profile(profile)
             status = profile.get("status")
             if status != "approved":
                 message = "Your account access was not approved." if status == "rejected" else "Your account is still waiting for admin approval."
@@ -504,6 +655,9 @@ async def settimer_start(update: Update, context: CallbackContext) -> int:
     return GET_USER_ID_TIMER
 
 async def received_user_id_timer(update: Update, context: CallbackContext) -> int:
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
+    if session is None:
+        return await _session_expired(update, "settimer")
     user_id = update.message.text
     telegram_id = update.effective_user.id
     profile, error_msg = await get_user_profile_by_id(user_id)
@@ -519,17 +673,20 @@ async def received_user_id_timer(update: Update, context: CallbackContext) -> in
         await update.message.reply_text(message)
         return ConversationHandler.END
     save_id_mapping(telegram_id, profile['id'])
-    context.user_data['profile'] = profile
+    session.set_profile(profile)
     await update.message.reply_text("Please enter the number of minutes for the timer.")
     return GET_MINUTES
 
 async def received_minutes(update: Update, context: CallbackContext) -> int:
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
+    if session is None:
+        return await _session_expired(update, "settimer")
     try:
         minutes = int(update.message.text)
         if minutes <= 0:
             await update.message.reply_text("Please enter a positive number.")
             return GET_MINUTES
-        context.user_data['minutes'] = minutes
+        session.minutes = minutes
         keyboard = [
             [InlineKeyboardButton("One-time", callback_data='one-time')],
             [InlineKeyboardButton("Repeating", callback_data='repeating')],
@@ -542,19 +699,23 @@ async def received_minutes(update: Update, context: CallbackContext) -> int:
         return GET_MINUTES
 
 async def choose_repeat(update: Update, context: CallbackContext) -> int:
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
+    if session is None:
+        return await _session_expired(update, "settimer")
     query = update.callback_query
     await query.answer()
     timer_type = query.data
-    context.user_data['timer_type'] = timer_type
+    session.timer_type = timer_type
     await query.edit_message_text(f"Timer type set to {timer_type}.")
     return await prompt_table_choice_timer(update, context)
 
 async def prompt_table_choice_timer(update: Update, context: CallbackContext) -> int:
-    profile = context.user_data.get('profile')
-    if not profile:
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
+    if session is None:
+        return await _session_expired(update, "settimer")
+    if not session.profile_id:
         await update.message.reply_text("Something went wrong. Please start over with /settimer.")
         return ConversationHandler.END
-    email = profile.get("email", "user")
     keyboard = [
         [InlineKeyboardButton("Real-time Data (followhour)", callback_data='followhour')],
         [InlineKeyboardButton("Daily Test Data (onetest)", callback_data='onetest')],
@@ -568,10 +729,13 @@ async def prompt_table_choice_timer(update: Update, context: CallbackContext) ->
     return CHOOSE_TABLE_TIMER
 
 async def choose_table_timer(update: Update, context: CallbackContext) -> int:
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
+    if session is None:
+        return await _session_expired(update, "settimer")
     query = update.callback_query
     await query.answer()
     table = query.data
-    context.user_data['table_choice'] = table
+    session.table_choice = table
     if table == 'onetest':
         keyboard = [
             [InlineKeyboardButton("View Last Record", callback_data='view_last')],
@@ -581,6 +745,7 @@ async def choose_table_timer(update: Update, context: CallbackContext) -> int:
     else:  # followhour
         keyboard = [
             [InlineKeyboardButton("View Latest Records", callback_data='view_latest')],
+            [InlineKeyboardButton("View Chart", callback_data='view_chart')],
             [InlineKeyboardButton("Filter by Date", callback_data='filter_date')],
             [InlineKeyboardButton("Filter by BPM Range", callback_data='filter_bpm_avg')],
             [InlineKeyboardButton("Filter by Temperature Range", callback_data='filter_temperature')],
@@ -590,44 +755,57 @@ async def choose_table_timer(update: Update, context: CallbackContext) -> int:
     return CHOOSE_ACTION_TIMER
 
 async def choose_action_timer(update: Update, context: CallbackContext) -> int:
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
+    if session is None:
+        return await _session_expired(update, "settimer")
     query = update.callback_query
     await query.answer()
     action = query.data
     if action == 'view_last':
-        context.user_data['mode'] = 'last'
+        session.mode = 'last'
         await query.edit_message_text(text="Timer will fetch the last record.")
         return await do_schedule(update, context)
     if action == 'view_latest':
-        context.user_data['mode'] = 'latest'
+        session.mode = 'latest'
         await query.edit_message_text(text="Please enter the number of latest records you would like to see (e.g., 10).")
         return CHOOSE_RECORDS_LATEST_TIMER
+    if action == 'view_chart':
+        session.mode = 'chart'
+        await query.edit_message_text(text=f"Please enter the range to chart ({RANGE_HELP}).")
+        return GET_CHART_RANGE_TIMER
     elif action.startswith('filter_'):
-        context.user_data['mode'] = 'filter'
+        session.mode = 'filter'
         filter_field = action.split('_', 1)[1]
-        context.user_data['filter_field'] = filter_field
+        session.filter_field = filter_field
         prompt = f"Please enter the value for {filter_field.replace('_', ' ')}:"
         if filter_field == 'date':
-            prompt += " (e.g., YYYY-MM-DD)"
+            prompt += " (e.g., YYYY-MM-DD or YYYY-MM-DD..YYYY-MM-DD)"
         elif filter_field in ['bpm_avg', 'temperature']:
             prompt = f"Please enter the range for {filter_field.replace('_', ' ')} (e.g., 60-90)."
         await query.edit_message_text(text=prompt)
         return GET_FILTER_VALUE_TIMER
 
 async def choose_records_latest_input_timer(update: Update, context: CallbackContext) -> int:
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
+    if session is None:
+        return await _session_expired(update, "settimer")
     try:
         limit = int(update.message.text)
         if limit <= 0:
             await update.message.reply_text("Please enter a positive number.")
             return CHOOSE_RECORDS_LATEST_TIMER
-        context.user_data['limit'] = limit
+        session.limit = limit
         return await do_schedule(update, context)
     except ValueError:
         await update.message.reply_text("That doesn't look like a valid number. Please enter a number.")
         return CHOOSE_RECORDS_LATEST_TIMER
 
 async def received_filter_value_timer(update: Update, context: CallbackContext) -> int:
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
+    if session is None:
+        return await _session_expired(update, "settimer")
     filter_value = update.message.text
-    filter_field = context.user_data.get('filter_field')
+    filter_field = session.filter_field
     if not filter_field:
         await update.message.reply_text("Error: Missing context for filtering. Please restart with /settimer.")
         return ConversationHandler.END
@@ -643,14 +821,27 @@ async def received_filter_value_timer(update: Update, context: CallbackContext)
             return GET_FILTER_VALUE_TIMER
     elif filter_field == 'date':
         try:
-            datetime.strptime(filter_value, '%Y-%m-%d')
-            parsed_filter_value = filter_value
+            first_day, last_day = _parse_day_range(filter_value)
+            parsed_filter_value = first_day if first_day == last_day else f"{first_day}..{last_day}"
         except ValueError:
-            await update.message.reply_text("Invalid date format. Please use YYYY-MM-DD (e.g., 2023-01-15).")
+            await update.message.reply_text("Invalid date format. Please use YYYY-MM-DD or YYYY-MM-DD..YYYY-MM-DD (e.g., 2023-01-15 or 2023-01-01..2023-01-07).")
             return GET_FILTER_VALUE_TIMER
     else:
         parsed_filter_value = filter_value
-    context.user_data['filter_value'] = parsed_filter_value
+    session.filter_value = parsed_filter_value
+    return await do_schedule(update, context)
+
+async def received_chart_range_timer(update: Update, context: CallbackContext) -> int:
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
+    if session is None:
+        return await _session_expired(update, "settimer")
+    chart_range = update.message.text.strip()
+    try:
+        parse_range(chart_range, session.timezone)
+    except ValueError:
+        await update.message.reply_text(f"Invalid range. Please use one of: {RANGE_HELP}.")
+        return GET_CHART_RANGE_TIMER
+    session.chart_range = chart_range
     return await do_schedule(update, context)
 
 # --- COMMAND HANDLERS ---
@@ -659,9 +850,10 @@ async def start_command(update: Update, context: CallbackContext):
     help_text = (
         "Welcome to the Health Monitoring Bot! Here are the available commands:\n\n"
         "• /start or /help: Show this help message.\n"
-        "• /data: Begin the process to view your health data.\n"
+        "• /data: Begin the process to view your health data as records or charts.\n"
         "• /settimer: Set a one-time or repeating timer to receive data after/every specified minutes.\n"
         "• /cleartimer: Clear the set timer.\n"
+        "• /export [followhour] [csv|parquet]: Download your devices' full history as a compressed file.\n"
         "• /logout: Clear your saved login information."
     )
     await update.message.reply_text(help_text)
@@ -670,13 +862,127 @@ async def help_command(update: Update, context: CallbackContext):
     """Displays a help message with available commands."""
     await start_command(update, context)
 
+async def export_command(update: Update, context: CallbackContext):
+    """Sends the full history of the user's devices as a compressed CSV or Parquet file."""
+    telegram_id = update.effective_user.id
+    profile_id = load_id_mapping().get(str(telegram_id))
+    if not profile_id:
+        await update.message.reply_text("No profile found. Please login with /data first.")
+        return
+    profile, error_msg = await get_user_profile_by_id(profile_id)
+    if error_msg or not profile:
+        await update.message.reply_text(error_msg or "Error fetching profile.")
+        return
+    status = profile.get("status")
+    if status != "approved":
+        message = "Your account access was not approved." if status == "rejected" else "Your account is still waiting for admin approval."
+        await update.message.reply_text(message)
+        return
+
+    table_choice, fmt = "followhour", "csv"
+    for arg in (a.lower() for a in context.args):
+        if arg in ("followhour", "onetest"):
+            table_choice = arg
+        elif arg in EXPORT_FORMATS:
+            fmt = arg
+        else:
+            await update.message.reply_text(f"Usage: /export [followhour] [{'|'.join(EXPORT_FORMATS)}]")
+            return
+    if table_choice == "onetest":
+        await update.message.reply_text("onetest readings are not linked to a device, so they cannot be exported per user.")
+        return
+
+    device_ids, error_msg = await get_profile_device_ids(profile_id)
+    if error_msg:
+        await update.message.reply_text(error_msg)
+        return
+    if not device_ids:
+        await update.message.reply_text("No devices are linked to your profile yet.")
+        return
+
+    await update.message.reply_text(f"Exporting {table_choice} as {fmt}, this may take a while...")
+    path, rows, error_msg = await asyncio.to_thread(export_table, supabase, table_choice, fmt, max_size=MAX_DOCUMENT_SIZE,
+                                                    device_ids=device_ids)
+    if error_msg:
+        await update.message.reply_text(error_msg)
+        return
+    try:
+        if rows == 0:
+            await update.message.reply_text(f"No records found in {table_choice} for your devices.")
+        elif os.path.getsize(path) > MAX_DOCUMENT_SIZE:
+            await update.message.reply_text("The export is larger than Telegram's 50 MB limit. Please use the web dashboard.")
+        else:
+            with open(path, 'rb') as f:
+                await update.message.reply_document(f, filename=os.path.basename(path), caption=f"{rows} records from {table_choice}.")
+    finally:
+        os.remove(path)
+
+async def _session_expired(update: Update, command: str) -> int:
+    """Ends a conversation whose session was evicted or never started."""
+    text = f"Your session expired. Please start again with /{command}."
+    if update.callback_query:
+        await update.callback_query.answer()
+        await update.callback_query.edit_message_text(text)
+    else:
+        await update.message.reply_text(text)
+    return ConversationHandler.END
+
+async def cancel_data(update: Update, context: CallbackContext) -> int:
+    """Abandons the /data conversation and shows the help message."""
+    sessions.discard(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    await start_command(update, context)
+    return ConversationHandler.END
+
+async def cancel_timer(update: Update, context: CallbackContext) -> int:
+    """Abandons the /settimer conversation and shows the help message."""
+    sessions.discard(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
+    await start_command(update, context)
+    return ConversationHandler.END
+
+async def data_timeout(update: Update, context: CallbackContext) -> None:
+    """Drops the session of a /data conversation ended by `conversation_timeout`."""
+    sessions.discard(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    await update.effective_chat.send_message("Your /data session expired. Please start again with /data.")
+
+async def timer_timeout(update: Update, context: CallbackContext) -> None:
+    """Drops the session of a /settimer conversation ended by `conversation_timeout`."""
+    sessions.discard(update.effective_chat.id, update.effective_user.id, TIMER_FLOW)
+    await update.effective_chat.send_message("Your /settimer session expired. Please start again with /settimer.")
+
+async def evict_idle_sessions(context: CallbackContext):
+    """Drops sessions left behind by conversations that were never finished."""
+    evicted = sessions.evict_idle()
+    if evicted:
+        logger.info(f"Evicted {evicted} idle sessions, {len(sessions)} remaining.")
+
+async def debug_command(update: Update, context: CallbackContext):
+    """Admin only: profiles the bot for a few seconds and dumps pending tasks and jobs."""
+    profile_id = load_id_mapping().get(str(update.effective_user.id))
+    profile = None
+    if profile_id:
+        profile, _ = await get_user_profile_by_id(profile_id)
+    if not profile or profile.get("role") != "admin":
+        await update.message.reply_text("This command is only available to administrators.")
+        return
+
+    seconds = int(context.args[0]) if context.args and context.args[0].isdigit() else 10
+    seconds = min(max(seconds, 1), MAX_PROFILE_SECONDS)
+    await update.message.reply_text(f"Profiling the bot for {seconds} seconds...")
+    counts = await sample_profile(seconds)
+
+    report = "\n\n".join([lag_monitor.summary(), top_functions(counts), dump_tasks(), dump_jobs(context.job_queue)])
+    await update.message.reply_text(report[:4000])
+    if counts:
+        await update.message.reply_document(collapsed_stacks(counts), filename="profile.collapsed.txt",
+                                            caption="Collapsed stacks for flamegraph.pl or speedscope.")
+
 async def logout_command(update: Update, context: CallbackContext):
     """Logs the user out by clearing their cached ID."""
     telegram_id = update.effective_user.id
     logged_out = clear_id_mapping(telegram_id)
 
     if logged_out:
-        context.user_data.clear()
+        sessions.discard(update.effective_chat.id, update.effective_user.id)
         await update.message.reply_text("You have been successfully logged out.")
     else:
         await update.message.reply_text("You were not logged in.")
@@ -684,6 +990,7 @@ async def logout_command(update: Update, context: CallbackContext):
 # --- DATA CONVERSATION HANDLERS ---
 async def data_start(update: Update, context: CallbackContext) -> int:
     """Entry point for the /data conversation. Checks for cached ID or asks for it."""
+    session = sessions.start(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
     telegram_id = update.effective_user.id
     id_mapping = load_id_mapping()
     cached_profile_id = id_mapping.get(str(telegram_id))
@@ -691,7 +998,7 @@ async def data_start(update: Update, context: CallbackContext) -> int:
     if cached_profile_id:
         profile, error_msg = await get_user_profile_by_id(cached_profile_id)
         if profile:
-            context.user_data['profile'] = profile
+            session.set_profile(profile)
             return await prompt_table_choice(update, context)
         else:
             logger.warning(f"Stale cached profile ID {cached_profile_id} for telegram_id {telegram_id}. Clearing.")
@@ -702,6 +1009,9 @@ async def data_start(update: Update, context: CallbackContext) -> int:
 
 async def received_user_id_data(update: Update, context: CallbackContext) -> int:
     """Handles the user ID entered during the /data flow."""
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    if session is None:
+        return await _session_expired(update, "data")
     user_id = update.message.text
     telegram_id = update.effective_user.id
     profile, error_msg = await get_user_profile_by_id(user_id)
@@ -714,17 +1024,19 @@ async def received_user_id_data(update: Update, context: CallbackContext) -> int
         return ConversationHandler.END
 
     save_id_mapping(telegram_id, profile['id'])
-    context.user_data['profile'] = profile
+    session.set_profile(profile)
     return await prompt_table_choice(update, context)
 
 async def prompt_table_choice(update: Update, context: CallbackContext) -> int:
     """Shows the table selection menu to the user."""
-    profile = context.user_data.get('profile')
-    if not profile:
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    if session is None:
+        return await _session_expired(update, "data")
+    if not session.profile_id:
         await update.message.reply_text("Something went wrong. Please start over with /data.")
         return ConversationHandler.END
 
-    status = profile.get("status")
+    status = session.status
     if status != "approved":
         message = "Your account access was not approved." if status == "rejected" else "Your account is still waiting for admin approval."
         if update.callback_query:
@@ -733,7 +1045,7 @@ async def prompt_table_choice(update: Update, context: CallbackContext) -> int:
             await update.message.reply_text(message)
         return ConversationHandler.END
 
-    email = profile.get("email", "user")
+    email = session.email or "user"
     keyboard = [
         [InlineKeyboardButton("Real-time Data (followhour)", callback_data='followhour')],
         [InlineKeyboardButton("Daily Test Data (onetest)", callback_data='onetest')],
@@ -750,10 +1062,13 @@ async def prompt_table_choice(update: Update, context: CallbackContext) -> int:
 
 async def choose_table(update: Update, context: CallbackContext) -> int:
     """Stores the chosen table and asks for the next action based on the table."""
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    if session is None:
+        return await _session_expired(update, "data")
     query = update.callback_query
     await query.answer()
     table = query.data
-    context.user_data['table_choice'] = table
+    session.table_choice = table
 
     if table == 'onetest':
         keyboard = [
@@ -764,6 +1079,7 @@ async def choose_table(update: Update, context: CallbackContext) -> int:
     else:  # followhour
         keyboard = [
             [InlineKeyboardButton("View Latest Records", callback_data='view_latest')],
+            [InlineKeyboardButton("View Chart", callback_data='view_chart')],
             [InlineKeyboardButton("Filter by Date", callback_data='filter_date')],
             [InlineKeyboardButton("Filter by BPM Range", callback_data='filter_bpm_avg')],
             [InlineKeyboardButton("Filter by Temperature Range", callback_data='filter_temperature')],
@@ -775,6 +1091,9 @@ async def choose_table(update: Update, context: CallbackContext) -> int:
 
 async def choose_action(update: Update, context: CallbackContext) -> int:
     """Handles the user's choice of action (view latest, view last, or filter)."""
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    if session is None:
+        return await _session_expired(update, "data")
     query = update.callback_query
     await query.answer()
     action = query.data
@@ -786,13 +1105,17 @@ async def choose_action(update: Update, context: CallbackContext) -> int:
         await query.edit_message_text(text="Please enter the number of latest records you would like to see (e.g., 10).")
         return CHOOSE_RECORDS_LATEST
 
+    if action == 'view_chart':
+        await query.edit_message_text(text=f"Please enter the range to chart ({RANGE_HELP}).")
+        return GET_CHART_RANGE
+
     elif action.startswith('filter_'):
         filter_field = action.split('_', 1)[1]
-        context.user_data['filter_field'] = filter_field
+        session.filter_field = filter_field
 
         prompt = f"Please enter the value for {filter_field.replace('_', ' ')}:"
         if filter_field == 'date':
-            prompt += " (e.g., YYYY-MM-DD)"
+            prompt += " (e.g., YYYY-MM-DD or YYYY-MM-DD..YYYY-MM-DD)"
         elif filter_field in ['bpm_avg', 'temperature']:
             prompt = f"Please enter the range for {filter_field.replace('_', ' ')} (e.g., 60-90)."
 
@@ -801,12 +1124,15 @@ async def choose_action(update: Update, context: CallbackContext) -> int:
 
 async def choose_records_latest_input(update: Update, context: CallbackContext) -> int:
     """Handles the numerical input for the number of latest records."""
+    session = sessions.get(update.effective_chat.id, update.effective_user.id, DATA_FLOW)
+    if session is None:
+        return await _session_expired(update, "data")
     try:
         limit = int(update.message.text)
         if limit <= 0:
             await update.message.reply_text("Please enter a positive number.")
             return CHOOSE_RECORDS_LATEST
-        context.user_data['limit'] = limit
+        session.limit = limit
         return await show_latest_records(update, context)
     except ValueError:
         await update.message.reply_text("That doesn't look like a valid number. Please enter a number.")
@@ -819,11 +1145,17 @@ async def error_handler(update: Update, context: CallbackContext) -> None:
         await update.effective_chat.send_message("An error occurred. Please try again or contact support.")
 
 # --- MAIN FUNCTION ---
+async def post_init(application: Application) -> None:
+    """Starts background monitoring once the event loop is running."""
+    lag_monitor.start()
+
 def main():
     """Starts the bot."""
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = Application.builder().token(TELEGRAM_TOKEN).post_init(post_init).build()
 
     load_timers(application.job_queue)
+    application.job_queue.run_repeating(poll_new_readings, READING_POLL_INTERVAL, first=5, name="poll_new_readings")
+    application.job_queue.run_repeating(evict_idle_sessions, SESSION_EVICT_INTERVAL, name="evict_idle_sessions")
 
     data_conv_handler = ConversationHandler(
         entry_points=[CommandHandler("data", data_start)],
@@ -833,8 +1165,11 @@ def main():
             CHOOSE_ACTION: [CallbackQueryHandler(choose_action)],
             CHOOSE_RECORDS_LATEST: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_records_latest_input)],
             GET_FILTER_VALUE: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_filter_value)],
+            GET_CHART_RANGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_chart_range)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, data_timeout)],
         },
-        fallbacks=[CommandHandler("cancel", start_command)],
+        fallbacks=[CommandHandler("cancel", cancel_data)],
+        conversation_timeout=CONVERSATION_TIMEOUT,
     )
 
     timer_conv_handler = ConversationHandler(
@@ -847,8 +1182,11 @@ def main():
             CHOOSE_ACTION_TIMER: [CallbackQueryHandler(choose_action_timer)],
             CHOOSE_RECORDS_LATEST_TIMER: [MessageHandler(filters.TEXT & ~filters.COMMAND, choose_records_latest_input_timer)],
             GET_FILTER_VALUE_TIMER: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_filter_value_timer)],
+            GET_CHART_RANGE_TIMER: [MessageHandler(filters.TEXT & ~filters.COMMAND, received_chart_range_timer)],
+            ConversationHandler.TIMEOUT: [TypeHandler(Update, timer_timeout)],
         },
-        fallbacks=[CommandHandler("cancel", start_command)],
+        fallbacks=[CommandHandler("cancel", cancel_timer)],
+        conversation_timeout=CONVERSATION_TIMEOUT,
     )
 
     application.add_handler(data_conv_handler)
@@ -858,6 +1196,9 @@ def main():
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("logout", logout_command))
     application.add_handler(CommandHandler("cleartimer", clear_timer))
+    application.add_handler(CommandHandler("export", export_command))
+    # Runs as a separate task so updates keep flowing while it samples.
+    application.add_handler(CommandHandler("debug", debug_command, block=False))
 
     application.add_error_handler(error_handler)
 
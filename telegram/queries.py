@@ -0,0 +1,68 @@
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# --- TABLE METADATA ---
+TIME_COLUMNS = {
+    "followhour": "time",
+    "onetest": "date",
+}
+
+def time_column_for(table_name: str) -> str:
+    """Returns the column a table is ordered by."""
+    return TIME_COLUMNS.get(table_name, "created_at")
+
+def parse_timestamp(value: str) -> datetime:
+    """Parses a Supabase ISO timestamp into an aware datetime."""
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+# --- KEYSET PAGINATION ---
+def keyset_filter(time_column: str, last_time: str, last_id: int, desc: bool = False) -> str:
+    """Builds a PostgREST `or` filter selecting rows strictly after (last_time, last_id)."""
+    op = "lt" if desc else "gt"
+    return f'{time_column}.{op}."{last_time}",and({time_column}.eq."{last_time}",id.{op}.{last_id})'
+
+def fetch_page(client, table_name: str, columns: str = "*", limit: int = 1000, after: tuple = None,
+               desc: bool = False, start: str = None, end: str = None, filters: dict = None):
+    """Fetches one page ordered by (time, id), starting after the `after` cursor.
+
+    `start` is inclusive and `end` is exclusive; `filters` adds equality
+    conditions, or `in` conditions for list values. Unlike offset paging, the cost of a page does not grow with
+    how deep into the table it is.
+    """
+    time_column = time_column_for(table_name)
+    query = client.table(table_name).select(columns).order(time_column, desc=desc).order("id", desc=desc)
+    if start:
+        query = query.gte(time_column, start)
+    if end:
+        query = query.lt(time_column, end)
+    for column, value in (filters or {}).items():
+        query = query.in_(column, value) if isinstance(value, (list, tuple)) else query.eq(column, value)
+    if after:
+        query = query.or_(keyset_filter(time_column, after[0], after[1], desc=desc))
+    return query.limit(limit).execute().data
+
+def page_cursor(rows: list, table_name: str):
+    """Returns the cursor pointing past the last row of a page."""
+    if not rows:
+        return None
+    last = rows[-1]
+    return last[time_column_for(table_name)], last["id"]
+
+def iter_chunks(client, table_name: str, columns: str = "*", chunk_size: int = 1000,
+                start: str = None, end: str = None, desc: bool = False, filters: dict = None):
+    """Yields successive pages of a table so callers never hold more than one chunk.
+
+    Only an empty page ends the scan: PostgREST caps a response at its
+    max-rows setting (1000 on Supabase), so a page shorter than `chunk_size`
+    does not mean the table is exhausted.
+    """
+    after = None
+    while True:
+        rows = fetch_page(client, table_name, columns=columns, limit=chunk_size, after=after,
+                          desc=desc, start=start, end=end, filters=filters)
+        if not rows:
+            return
+        yield rows
+        after = page_cursor(rows, table_name)
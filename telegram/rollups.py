@@ -0,0 +1,239 @@
+import os
+import math
+import logging
+import argparse
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+from queries import iter_chunks, parse_timestamp
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+ROLLUP_TABLES = {
+    "hour": "followhour_rollup_hourly",
+    "day": "followhour_rollup_daily",
+}
+DEFAULT_DEVICE_ID = "default"
+DEFAULT_DEVICE_TIMEZONE = 'Asia/Ho_Chi_Minh'
+BACKFILL_CHUNK_SIZE = 5000
+UPSERT_BATCH_SIZE = 500
+ROLLUP_PAGE_SIZE = 1000
+
+# --- BUCKETING ---
+def bucket_start(ts: datetime, grain: str, device_tz: str = DEFAULT_DEVICE_TIMEZONE) -> datetime:
+    """Truncates a timestamp to the start of its UTC hour or of its day in the device's timezone."""
+    if grain == "hour":
+        return ts.astimezone(timezone.utc).replace(minute=0, second=0, microsecond=0)
+    if grain == "day":
+        tz = pytz.timezone(device_tz)
+        return tz.localize(datetime.combine(ts.astimezone(tz).date(), datetime.min.time()))
+    raise ValueError(f"Unknown rollup grain: {grain}")
+
+def bucket_end(start: datetime, grain: str) -> datetime:
+    if grain == "hour":
+        return start + timedelta(hours=1)
+    # The next local midnight, which is not always 24 hours away across DST changes.
+    tz = pytz.timezone(start.tzinfo.zone)
+    return tz.localize(datetime.combine(start.date() + timedelta(days=1), datetime.min.time()))
+
+def load_device_timezones(client) -> dict:
+    """Maps device ids to their timezone (sql/002); unknown devices use the default."""
+    try:
+        rows = client.table("devices").select("device_id,timezone").execute().data
+    except Exception as e:
+        logger.warning(f"Could not load device timezones, using {DEFAULT_DEVICE_TIMEZONE}: {e}")
+        return {}
+    return {row["device_id"]: row["timezone"] for row in rows}
+
+class RollupBucket:
+    """Running count/min/max/sum/sum-of-squares for BPM and temperature."""
+    __slots__ = ("count", "bpm_min", "bpm_max", "bpm_sum", "bpm_sumsq",
+                 "temp_min", "temp_max", "temp_sum", "temp_sumsq")
+
+    def __init__(self):
+        self.count = 0
+        self.bpm_min = self.temp_min = math.inf
+        self.bpm_max = self.temp_max = -math.inf
+        self.bpm_sum = self.bpm_sumsq = 0.0
+        self.temp_sum = self.temp_sumsq = 0.0
+
+    def add(self, bpm: float, temp: float):
+        self.count += 1
+        self.bpm_min = min(self.bpm_min, bpm)
+        self.bpm_max = max(self.bpm_max, bpm)
+        self.bpm_sum += bpm
+        self.bpm_sumsq += bpm * bpm
+        self.temp_min = min(self.temp_min, temp)
+        self.temp_max = max(self.temp_max, temp)
+        self.temp_sum += temp
+        self.temp_sumsq += temp * temp
+
+    def to_row(self, device_id: str, bucket: datetime) -> dict:
+        return {
+            "device_id": device_id,
+            "bucket": bucket.isoformat(),
+            "count": self.count,
+            "bpm_min": self.bpm_min,
+            "bpm_max": self.bpm_max,
+            "bpm_sum": self.bpm_sum,
+            "bpm_sumsq": self.bpm_sumsq,
+            "temp_min": self.temp_min,
+            "temp_max": self.temp_max,
+            "temp_sum": self.temp_sum,
+            "temp_sumsq": self.temp_sumsq,
+        }
+
+def summarize(row: dict) -> dict:
+    """Derives mean and standard deviation from a rollup row."""
+    count = row["count"]
+    summary = {"bucket": row["bucket"], "count": count}
+    for prefix in ("bpm", "temp"):
+        mean = row[f"{prefix}_sum"] / count
+        variance = max(row[f"{prefix}_sumsq"] / count - mean * mean, 0.0)
+        summary[f"{prefix}_min"] = row[f"{prefix}_min"]
+        summary[f"{prefix}_max"] = row[f"{prefix}_max"]
+        summary[f"{prefix}_mean"] = round(mean, 2)
+        summary[f"{prefix}_std"] = round(math.sqrt(variance), 2)
+    return summary
+
+def merge_rows(rows: list) -> dict:
+    """Combines several rollup rows (e.g. all days of a month) into one."""
+    merged = dict(rows[0])
+    for row in rows[1:]:
+        merged["count"] += row["count"]
+        for prefix in ("bpm", "temp"):
+            merged[f"{prefix}_min"] = min(merged[f"{prefix}_min"], row[f"{prefix}_min"])
+            merged[f"{prefix}_max"] = max(merged[f"{prefix}_max"], row[f"{prefix}_max"])
+            merged[f"{prefix}_sum"] += row[f"{prefix}_sum"]
+            merged[f"{prefix}_sumsq"] += row[f"{prefix}_sumsq"]
+    return merged
+
+# --- READING ---
+def fetch_rollups(client, grain: str, start: str = None, end: str = None, device_id: str = DEFAULT_DEVICE_ID):
+    """Fetches rollup rows for a device in [start, end).
+
+    Pages by `bucket` until an empty page, since PostgREST caps each response
+    (1000 rows on Supabase) and the newest buckets would otherwise be cut off.
+    """
+    if grain not in ROLLUP_TABLES:
+        return None, f"Unknown rollup grain: {grain}"
+    rows = []
+    try:
+        while True:
+            query = client.table(ROLLUP_TABLES[grain]).select("*").eq("device_id", device_id).order("bucket")
+            if rows:
+                query = query.gt("bucket", rows[-1]["bucket"])
+            elif start:
+                query = query.gte("bucket", start)
+            if end:
+                query = query.lt("bucket", end)
+            page = query.limit(ROLLUP_PAGE_SIZE).execute().data
+            if not page:
+                return rows, None
+            rows.extend(page)
+    except Exception as e:
+        logger.error(f"Error fetching {grain} rollups: {e}")
+        return None, "An error occurred while fetching summaries."
+
+# --- BACKFILL ---
+def _bucket_ceil(ts: datetime, grain: str, device_tz: str = DEFAULT_DEVICE_TIMEZONE) -> datetime:
+    first = bucket_start(ts, grain, device_tz)
+    return ts if first == ts else bucket_end(first, grain)
+
+def backfill_window(start: datetime, end: datetime, now: datetime, timezones) -> tuple:
+    """Widens [start, end) to whole hour and day buckets, capped at `now`.
+
+    The start moves back to the earliest bucket boundary at or before it in
+    any of `timezones`; the end moves forward to the latest boundary at or
+    after it but never past `now`, so buckets still receiving readings are
+    left to the trigger.
+    """
+    if start is not None:
+        start = min([bucket_start(start, "hour")] + [bucket_start(start, "day", tz) for tz in timezones])
+    if end is not None:
+        now = min(now, max([_bucket_ceil(end, "hour")] + [_bucket_ceil(end, "day", tz) for tz in timezones]))
+    return start, now
+
+def _flush(client, grain: str, buckets: dict, before: datetime, not_before: datetime = None) -> int:
+    """Upserts buckets that end at or before `before` and drops them.
+
+    Buckets starting before `not_before` were only partly scanned, so they are
+    dropped without being written.
+    """
+    done = [(key, buckets.pop(key)) for key in list(buckets) if bucket_end(key[1], grain) <= before]
+    rows = [bucket.to_row(*key) for key, bucket in done if not_before is None or key[1] >= not_before]
+    for i in range(0, len(rows), UPSERT_BATCH_SIZE):
+        client.table(ROLLUP_TABLES[grain]).upsert(rows[i:i + UPSERT_BATCH_SIZE], on_conflict="device_id,bucket").execute()
+    return len(rows)
+
+def backfill_rollups(client, start: str = None, end: str = None, chunk_size: int = BACKFILL_CHUNK_SIZE) -> dict:
+    """Rebuilds rollup rows from `followhour` history in streaming chunks.
+
+    Hourly buckets are UTC hours; daily buckets start at local midnight in
+    each device's timezone, matching the triggers in sql/002.
+
+    Rows are read in (time, id) order, so once a chunk moves past a bucket the
+    bucket is complete and is written out. Memory stays bounded by one chunk
+    plus the buckets still open at its end. Buckets are overwritten, which makes
+    the job safe to re-run over the same range.
+
+    The range is widened to whole buckets (see `backfill_window`) so edge
+    buckets are never overwritten with partial counts, and it stops before the
+    current hour and day: the insert trigger keeps adding to those, and an
+    overwrite would lose readings inserted after the scan passed them. Those
+    buckets are complete because sql/001 rolls up history in the same
+    transaction that installs the trigger; re-run once they close if not.
+    """
+    device_timezones = load_device_timezones(client)
+    timezones = set(device_timezones.values()) | {DEFAULT_DEVICE_TIMEZONE}
+    start, end = backfill_window(parse_timestamp(start) if start else None, parse_timestamp(end) if end else None,
+                                 datetime.now(timezone.utc), timezones)
+    open_buckets = {grain: {} for grain in ROLLUP_TABLES}
+    written = {grain: 0 for grain in ROLLUP_TABLES}
+    readings = 0
+    for rows in iter_chunks(client, "followhour", columns="id,time,bpm_avg,temperature,device_id", chunk_size=chunk_size,
+                            start=start.isoformat() if start else None, end=end.isoformat()):
+        for row in rows:
+            if row.get("bpm_avg") is None or row.get("temperature") is None:
+                continue
+            ts = parse_timestamp(row["time"])
+            device_id = row.get("device_id") or DEFAULT_DEVICE_ID
+            device_tz = device_timezones.get(device_id, DEFAULT_DEVICE_TIMEZONE)
+            for grain, buckets in open_buckets.items():
+                key = (device_id, bucket_start(ts, grain, device_tz))
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = RollupBucket()
+                bucket.add(float(row["bpm_avg"]), float(row["temperature"]))
+        readings += len(rows)
+        watermark = parse_timestamp(rows[-1]["time"])
+        for grain, buckets in open_buckets.items():
+            written[grain] += _flush(client, grain, buckets, before=watermark, not_before=start)
+        logger.info(f"Rollup backfill: {readings} readings processed.")
+    for grain, buckets in open_buckets.items():
+        written[grain] += _flush(client, grain, buckets, before=end, not_before=start)
+        if buckets:
+            logger.info(f"Rollup backfill: left {len(buckets)} open {grain} buckets to the trigger.")
+    return {"readings": readings, **{f"{grain}_buckets": n for grain, n in written.items()}}
+
+def main():
+    """Runs the backfill from the command line."""
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    parser = argparse.ArgumentParser(description="Backfill followhour rollup tables.")
+    parser.add_argument("--start", help="ISO timestamp to start from, widened back to whole buckets.")
+    parser.add_argument("--end", help="ISO timestamp to stop at, widened to whole buckets; defaults to now.")
+    parser.add_argument("--chunk-size", type=int, default=BACKFILL_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    load_dotenv()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    client = create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+    result = backfill_rollups(client, start=args.start, end=args.end, chunk_size=args.chunk_size)
+    logger.info(f"Rollup backfill finished: {result}")
+
+if __name__ == "__main__":
+    main()
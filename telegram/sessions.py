@@ -0,0 +1,131 @@
+import time
+import argparse
+import tracemalloc
+
+# --- CONFIGURATION ---
+DEFAULT_TIMEZONE = 'Asia/Ho_Chi_Minh'
+CONVERSATION_TIMEOUT = 600   # seconds of silence before a /data or /settimer flow is ended
+SESSION_IDLE_TIMEOUT = 900   # seconds before an orphaned session is evicted
+SESSION_EVICT_INTERVAL = 300
+
+class ChatSession:
+    """State of one in-progress /data or /settimer conversation.
+
+    Only the profile fields the flows read are kept, instead of the whole
+    profile row, and `__slots__` avoids a per-instance dict.
+    """
+    __slots__ = ("profile_id", "email", "status", "timezone",
+                 "table_choice", "mode", "limit", "filter_field", "filter_value", "chart_range",
+                 "minutes", "timer_type", "last_seen")
+
+    def __init__(self):
+        self.profile_id = None
+        self.email = None
+        self.status = None
+        self.timezone = DEFAULT_TIMEZONE
+        self.table_choice = None
+        self.mode = None
+        self.limit = None
+        self.filter_field = None
+        self.filter_value = None
+        self.chart_range = None
+        self.minutes = None
+        self.timer_type = None
+        self.last_seen = time.monotonic()
+
+    def set_profile(self, profile: dict):
+        self.profile_id = profile.get("id")
+        self.email = profile.get("email")
+        self.status = profile.get("status")
+        self.timezone = profile.get("timezone") or DEFAULT_TIMEZONE
+
+class SessionStore:
+    """Sessions keyed by chat, user and flow, with eviction of the ones left idle.
+
+    The key matches ConversationHandler's own (per chat and per user), so two
+    users in one group chat never share a session. /data and /settimer each
+    get their own session, so starting or ending one flow never touches the
+    state of the other one.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, chat_id: int, user_id: int, flow: str):
+        """Returns the flow's session and marks it active, or None if it expired or was never started."""
+        session = self._sessions.get((chat_id, user_id, flow))
+        if session is not None:
+            session.last_seen = time.monotonic()
+        return session
+
+    def start(self, chat_id: int, user_id: int, flow: str) -> ChatSession:
+        """Replaces any leftover session with a fresh one at the start of a flow."""
+        session = self._sessions[(chat_id, user_id, flow)] = ChatSession()
+        return session
+
+    def discard(self, chat_id: int, user_id: int, flow: str = None):
+        """Drops the user's session of one flow, or of every flow in the chat if `flow` is None."""
+        if flow is not None:
+            self._sessions.pop((chat_id, user_id, flow), None)
+            return
+        for key in [key for key in self._sessions if key[:2] == (chat_id, user_id)]:
+            del self._sessions[key]
+
+    def evict_idle(self, max_idle: float = SESSION_IDLE_TIMEOUT) -> int:
+        """Drops sessions not touched for `max_idle` seconds and returns how many were dropped."""
+        cutoff = time.monotonic() - max_idle
+        idle = [key for key, session in self._sessions.items() if session.last_seen < cutoff]
+        for key in idle:
+            del self._sessions[key]
+        return len(idle)
+
+# --- BENCHMARK ---
+def _sample_profile(i: int) -> dict:
+    return {
+        "id": f"{i:08x}-0000-4000-8000-000000000000",
+        "email": f"user{i}@example.com",
+        "status": "approved",
+        "role": "user",
+        "timezone": DEFAULT_TIMEZONE,
+        "created_at": "2025-07-01T00:00:00+00:00",
+        "updated_at": "2025-07-01T00:00:00+00:00",
+    }
+
+def _measure(build, users: int) -> int:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    store = build(users)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del store
+    return size
+
+def _build_user_data(users: int) -> dict:
+    # The previous layout: a user_data dict holding the whole profile plus loose keys.
+    store = {}
+    for i in range(users):
+        store[i] = {"profile": _sample_profile(i), "table_choice": "followhour", "mode": "latest", "limit": 10}
+    return store
+
+def _build_sessions(users: int) -> SessionStore:
+    store = SessionStore()
+    for i in range(users):
+        session = store.start(i, i, "data")
+        session.set_profile(_sample_profile(i))
+        session.table_choice, session.mode, session.limit = "followhour", "latest", 10
+    return store
+
+def benchmark(users: int = 100_000):
+    """Compares resident size of dict-based user_data with ChatSession objects."""
+    for label, build in (("user_data dicts", _build_user_data), ("ChatSession", _build_sessions)):
+        size = _measure(build, users)
+        print(f"{label}: {size / 1024 / 1024:.1f} MiB for {users:,} users ({size / users:.0f} B/user)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure session memory use.")
+    parser.add_argument("--users", type=int, default=100_000)
+    args = parser.parse_args()
+    benchmark(users=args.users)
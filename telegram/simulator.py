@@ -0,0 +1,238 @@
+import os
+import math
+import time
+import random
+import asyncio
+import argparse
+import logging
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from anomaly import AnomalyDetector, detect_anomalies
+
+logger = logging.getLogger(__name__)
+
+# --- CONFIGURATION ---
+FOLLOWHOUR_INTERVAL = 15.0   # seconds, followHourInterval in the ESP32 sketch
+ONETEST_AFTER = 60.0         # seconds of finger contact before a onetest row is sent
+BOT_POLL_INTERVAL = 15.0     # READING_POLL_INTERVAL in main.py
+BOT_POLL_PAGE_SIZE = 1000    # READING_POLL_PAGE_SIZE in main.py
+DEVICE_TZ = timezone(timedelta(hours=7))  # the firmware stamps readings in GMT+7
+
+def is_valid_sensor_data(bpm: float, temp: float) -> bool:
+    """Same bounds as isValidSensorData in the firmware."""
+    return 30 <= bpm <= 200 and 20 <= temp <= 45
+
+def firmware_payload(timestamp_field: str, bpm: float, temp: float, device_id: str = None) -> dict:
+    """Builds the JSON body sendToSupabase posts, plus the device id for followhour.
+
+    onetest has no device_id column, so its rows are sent without one.
+    """
+    payload = {
+        timestamp_field: datetime.now(DEVICE_TZ).strftime("%Y-%m-%dT%H:%M:%S") + "+07:00",
+        "bpm_avg": round(bpm, 2),
+        "temperature": round(temp, 2),
+    }
+    if device_id is not None:
+        payload["device_id"] = device_id
+    return payload
+
+# --- VIRTUAL DEVICES ---
+class VirtualDevice:
+    """Produces plausible readings for one wearer: baseline, daily cycle, noise and rare anomalies."""
+
+    def __init__(self, device_id: str, rng: random.Random, anomaly_rate: float):
+        self.device_id = device_id
+        self.rng = rng
+        self.anomaly_rate = anomaly_rate
+        self.base_bpm = rng.uniform(60, 90)
+        self.base_temp = rng.uniform(36.2, 37.0)
+        self.phase = rng.uniform(0, 2 * math.pi)
+
+    def reading(self, elapsed: float):
+        """Returns (bpm, temp, injected_anomaly) for `elapsed` seconds into the run."""
+        cycle = math.sin(2 * math.pi * elapsed / 86400 + self.phase)
+        bpm = self.base_bpm + 5 * cycle + self.rng.gauss(0, 2.5)
+        temp = self.base_temp + 0.3 * cycle + self.rng.gauss(0, 0.08)
+        injected = self.rng.random() < self.anomaly_rate
+        if injected:
+            if self.rng.random() < 0.5:
+                bpm += self.rng.choice((-1, 1)) * self.rng.uniform(35, 60)
+            else:
+                temp += self.rng.uniform(1.5, 3.0)
+        return bpm, temp, injected
+
+# --- DATABASE TARGETS ---
+class LocalDatabase:
+    """In-process stand-in for the followhour/onetest tables."""
+
+    def __init__(self):
+        self.tables = {"followhour": [], "onetest": []}
+
+    async def insert(self, table_name: str, payload: dict) -> int:
+        rows = self.tables[table_name]
+        row = dict(payload, id=len(rows) + 1)
+        rows.append(row)
+        return row["id"]
+
+    async def fetch_after(self, table_name: str, after_id: int, limit: int = 1000) -> list:
+        return self.tables[table_name][after_id:after_id + limit]
+
+    async def close(self):
+        pass
+
+class PostgrestDatabase:
+    """Posts to a PostgREST endpoint (e.g. `supabase start`) with the firmware's headers."""
+
+    def __init__(self, url: str, key: str, connections: int = 100):
+        import httpx
+        self.client = httpx.AsyncClient(
+            base_url=f"{url.rstrip('/')}/rest/v1",
+            headers={"apikey": key, "Authorization": f"Bearer {key}"},
+            limits=httpx.Limits(max_connections=connections),
+            timeout=30,
+        )
+
+    async def insert(self, table_name: str, payload: dict) -> int:
+        response = await self.client.post(f"/{table_name}", json=payload, headers={"Prefer": "return=representation"})
+        response.raise_for_status()
+        return response.json()[0]["id"]
+
+    async def fetch_after(self, table_name: str, after_id: int, limit: int = 1000) -> list:
+        params = {"select": "*", "id": f"gt.{after_id}", "order": "id", "limit": str(limit)}
+        response = await self.client.get(f"/{table_name}", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def close(self):
+        await self.client.aclose()
+
+# --- SIMULATION ---
+class Stats:
+    def __init__(self):
+        self.sent_at = {}          # followhour id -> monotonic send time
+        self.injected = set()      # followhour ids carrying an injected anomaly
+        self.ingest = []           # seconds per insert call
+        self.processed = []        # seconds from send to being seen by the consumer
+        self.detected = []         # seconds from send to detection, for injected anomalies
+        self.alerts = 0
+        self.dropped = 0
+        self.errors = 0
+        self.onetest = 0
+
+async def run_device(device: VirtualDevice, db, interval: float, duration: float, stats: Stats, started: float):
+    # Stagger start-up so devices do not all post in the same instant.
+    await asyncio.sleep(device.rng.uniform(0, interval))
+    onetest_sent = False
+    while True:
+        elapsed = time.monotonic() - started
+        if elapsed >= duration:
+            return
+        bpm, temp, injected = device.reading(elapsed)
+        if not is_valid_sensor_data(bpm, temp):
+            stats.dropped += 1
+        else:
+            sent = time.monotonic()
+            try:
+                row_id = await db.insert("followhour", firmware_payload("time", bpm, temp, device.device_id))
+                stats.ingest.append(time.monotonic() - sent)
+                stats.sent_at[row_id] = sent
+                if injected:
+                    stats.injected.add(row_id)
+                if not onetest_sent and elapsed >= ONETEST_AFTER * interval / FOLLOWHOUR_INTERVAL:
+                    await db.insert("onetest", firmware_payload("date", bpm, temp))
+                    stats.onetest += 1
+                    onetest_sent = True
+            except Exception as e:
+                stats.errors += 1
+                logger.debug(f"{device.device_id} insert failed: {e}")
+        await asyncio.sleep(interval)
+
+async def run_consumer(db, detector: AnomalyDetector, poll_interval: float, stats: Stats, stop: asyncio.Event):
+    """Polls like the bot's poll_new_readings job: by id, draining pages until one is empty,
+    through the same detect_anomalies(). Sending the Telegram message is not simulated.
+    """
+    cursor = 0
+    while True:
+        stopping = stop.is_set()
+        while True:
+            rows = await db.fetch_after("followhour", cursor, limit=BOT_POLL_PAGE_SIZE)
+            if not rows:
+                break
+            cursor = rows[-1]["id"]
+            seen = time.monotonic()
+            for row in rows:
+                sent = stats.sent_at.get(row["id"])
+                if sent is not None:
+                    stats.processed.append(seen - sent)
+            flagged = {row["id"] for _, row in detect_anomalies(detector, rows)}
+            stats.alerts += len(flagged)
+            stats.detected.extend(seen - stats.sent_at[row_id] for row_id in flagged & stats.injected)
+        if stopping:
+            return
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+def _percentiles(values: list) -> str:
+    if not values:
+        return "n/a"
+    p50, p95, p99 = np.percentile(np.array(values) * 1000, [50, 95, 99])
+    return f"p50 {p50:.1f} ms, p95 {p95:.1f} ms, p99 {p99:.1f} ms"
+
+async def simulate(db, devices: int, duration: float, interval: float, poll_interval: float,
+                   anomaly_rate: float, seed: int = 0) -> Stats:
+    rng = random.Random(seed)
+    # Short runs need a short warm-up, or nothing is ever flagged.
+    detector = AnomalyDetector(warmup=min(40, max(5, int(duration / interval) // 4)), cooldown=0)
+    stats = Stats()
+    stop = asyncio.Event()
+    consumer = asyncio.create_task(run_consumer(db, detector, poll_interval, stats, stop))
+    started = time.monotonic()
+    fleet = [VirtualDevice(f"sim-{i:05d}", random.Random(rng.random()), anomaly_rate) for i in range(devices)]
+    await asyncio.gather(*(run_device(d, db, interval, duration, stats, started) for d in fleet))
+    stop.set()
+    await consumer
+    return stats
+
+def report(stats: Stats, devices: int, duration: float, poll_interval: float):
+    readings = len(stats.sent_at)
+    print(f"devices: {devices:,}, readings: {readings:,} ({readings / duration:,.0f}/s), "
+          f"onetest: {stats.onetest:,}, dropped by firmware bounds: {stats.dropped:,}, errors: {stats.errors:,}")
+    print(f"ingest (insert call):   {_percentiles(stats.ingest)}")
+    print(f"ingest -> polled:       {_percentiles(stats.processed)}")
+    print(f"ingest -> detected:     {_percentiles(stats.detected)}")
+    print(f"alerts: {stats.alerts:,}, injected anomalies detected: {len(stats.detected):,}/{len(stats.injected):,}")
+    # Latency is dominated by waiting for the next poll; the Telegram send comes on top of it.
+    note = "" if poll_interval == BOT_POLL_INTERVAL else f" (the bot polls every {BOT_POLL_INTERVAL:g}s)"
+    print(f"poll interval: {poll_interval:g}s{note}; Telegram delivery time is not included")
+
+async def _main(args):
+    if args.supabase_url:
+        db = PostgrestDatabase(args.supabase_url, args.supabase_key or os.getenv("SUPABASE_KEY", ""))
+    else:
+        db = LocalDatabase()
+    try:
+        stats = await simulate(db, args.devices, args.duration, args.interval, args.poll_interval,
+                               args.anomaly_rate, args.seed)
+    finally:
+        await db.close()
+    report(stats, args.devices, args.duration, args.poll_interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate a fleet of ESP32 health monitors.")
+    parser.add_argument("--devices", type=int, default=2000)
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run.")
+    parser.add_argument("--interval", type=float, default=FOLLOWHOUR_INTERVAL,
+                        help="Seconds between followhour posts per device (lower it to compress time).")
+    parser.add_argument("--poll-interval", type=float, default=BOT_POLL_INTERVAL,
+                        help="Seconds between consumer polls (the bot's interval by default).")
+    parser.add_argument("--anomaly-rate", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--supabase-url", help="PostgREST target, e.g. a local `supabase start` instance.")
+    parser.add_argument("--supabase-key")
+    args = parser.parse_args()
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    asyncio.run(_main(args))
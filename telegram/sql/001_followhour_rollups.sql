@@ -0,0 +1,143 @@
+-- Hourly and daily rollups of followhour readings.
+-- Run once in the Supabase SQL editor. Existing history is rolled up in the same
+-- transaction; `python rollups.py` is only needed to repair rollups later.
+
+begin;
+
+-- Held until commit: no reading can land between the rebuild below and the
+-- triggers taking over, so the hour the migration runs in is complete too.
+lock table followhour in share row exclusive mode;
+
+alter table followhour add column if not exists device_id text not null default 'default';
+create index if not exists followhour_device_time_idx on followhour (device_id, time, id);
+
+create table if not exists followhour_rollup_hourly (
+    device_id  text             not null,
+    bucket     timestamptz      not null,
+    count      bigint           not null,
+    bpm_min    double precision not null,
+    bpm_max    double precision not null,
+    bpm_sum    double precision not null,
+    bpm_sumsq  double precision not null,
+    temp_min   double precision not null,
+    temp_max   double precision not null,
+    temp_sum   double precision not null,
+    temp_sumsq double precision not null,
+    primary key (device_id, bucket)
+);
+
+create table if not exists followhour_rollup_daily (like followhour_rollup_hourly including all);
+
+-- Inserts fold each new reading into its hour and day bucket.
+create or replace function followhour_rollup_insert() returns trigger
+language plpgsql as $$
+begin
+    if new.bpm_avg is null or new.temperature is null then
+        return new;
+    end if;
+
+    insert into followhour_rollup_hourly as r
+    values (new.device_id, date_trunc('hour', new.time, 'UTC'), 1,
+            new.bpm_avg, new.bpm_avg, new.bpm_avg, new.bpm_avg::float8 * new.bpm_avg,
+            new.temperature, new.temperature, new.temperature, new.temperature::float8 * new.temperature)
+    on conflict (device_id, bucket) do update set
+        count      = r.count + 1,
+        bpm_min    = least(r.bpm_min, excluded.bpm_min),
+        bpm_max    = greatest(r.bpm_max, excluded.bpm_max),
+        bpm_sum    = r.bpm_sum + excluded.bpm_sum,
+        bpm_sumsq  = r.bpm_sumsq + excluded.bpm_sumsq,
+        temp_min   = least(r.temp_min, excluded.temp_min),
+        temp_max   = greatest(r.temp_max, excluded.temp_max),
+        temp_sum   = r.temp_sum + excluded.temp_sum,
+        temp_sumsq = r.temp_sumsq + excluded.temp_sumsq;
+
+    insert into followhour_rollup_daily as r
+    values (new.device_id, date_trunc('day', new.time, 'UTC'), 1,
+            new.bpm_avg, new.bpm_avg, new.bpm_avg, new.bpm_avg::float8 * new.bpm_avg,
+            new.temperature, new.temperature, new.temperature, new.temperature::float8 * new.temperature)
+    on conflict (device_id, bucket) do update set
+        count      = r.count + 1,
+        bpm_min    = least(r.bpm_min, excluded.bpm_min),
+        bpm_max    = greatest(r.bpm_max, excluded.bpm_max),
+        bpm_sum    = r.bpm_sum + excluded.bpm_sum,
+        bpm_sumsq  = r.bpm_sumsq + excluded.bpm_sumsq,
+        temp_min   = least(r.temp_min, excluded.temp_min),
+        temp_max   = greatest(r.temp_max, excluded.temp_max),
+        temp_sum   = r.temp_sum + excluded.temp_sum,
+        temp_sumsq = r.temp_sumsq + excluded.temp_sumsq;
+
+    return new;
+end;
+$$;
+
+-- Deletes (e.g. "Clean followHour" in the dashboard) cannot be subtracted from
+-- min/max, so the touched buckets are recomputed from the remaining readings.
+-- The readings are REAL; sums are taken in float8 so they match the Python backfill.
+create or replace function followhour_rollup_delete() returns trigger
+language plpgsql as $$
+begin
+    delete from followhour_rollup_hourly r
+    using (select distinct device_id, date_trunc('hour', time, 'UTC') as bucket from old_rows) t
+    where r.device_id = t.device_id and r.bucket = t.bucket;
+
+    insert into followhour_rollup_hourly
+    select f.device_id, date_trunc('hour', f.time, 'UTC'), count(*),
+           min(f.bpm_avg), max(f.bpm_avg), sum(f.bpm_avg::float8), sum(f.bpm_avg::float8 * f.bpm_avg),
+           min(f.temperature), max(f.temperature), sum(f.temperature::float8), sum(f.temperature::float8 * f.temperature)
+    from followhour f
+    join (select distinct device_id, date_trunc('hour', time, 'UTC') as bucket from old_rows) t
+      on f.device_id = t.device_id
+     and f.time >= t.bucket and f.time < t.bucket + interval '1 hour'
+    where f.bpm_avg is not null and f.temperature is not null
+    group by 1, 2;
+
+    delete from followhour_rollup_daily r
+    using (select distinct device_id, date_trunc('day', time, 'UTC') as bucket from old_rows) t
+    where r.device_id = t.device_id and r.bucket = t.bucket;
+
+    insert into followhour_rollup_daily
+    select f.device_id, date_trunc('day', f.time, 'UTC'), count(*),
+           min(f.bpm_avg), max(f.bpm_avg), sum(f.bpm_avg::float8), sum(f.bpm_avg::float8 * f.bpm_avg),
+           min(f.temperature), max(f.temperature), sum(f.temperature::float8), sum(f.temperature::float8 * f.temperature)
+    from followhour f
+    join (select distinct device_id, date_trunc('day', time, 'UTC') as bucket from old_rows) t
+      on f.device_id = t.device_id
+     and f.time >= t.bucket and f.time < t.bucket + interval '1 day'
+    where f.bpm_avg is not null and f.temperature is not null
+    group by 1, 2;
+
+    return null;
+end;
+$$;
+
+drop trigger if exists followhour_rollup_insert on followhour;
+create trigger followhour_rollup_insert
+    after insert on followhour
+    for each row execute function followhour_rollup_insert();
+
+drop trigger if exists followhour_rollup_delete on followhour;
+create trigger followhour_rollup_delete
+    after delete on followhour
+    referencing old table as old_rows
+    for each statement execute function followhour_rollup_delete();
+
+-- Readings from before the triggers existed.
+delete from followhour_rollup_hourly;
+insert into followhour_rollup_hourly
+select device_id, date_trunc('hour', time, 'UTC'), count(*),
+       min(bpm_avg), max(bpm_avg), sum(bpm_avg::float8), sum(bpm_avg::float8 * bpm_avg),
+       min(temperature), max(temperature), sum(temperature::float8), sum(temperature::float8 * temperature)
+from followhour
+where bpm_avg is not null and temperature is not null
+group by device_id, date_trunc('hour', time, 'UTC');
+
+delete from followhour_rollup_daily;
+insert into followhour_rollup_daily
+select device_id, date_trunc('day', time, 'UTC'), count(*),
+       min(bpm_avg), max(bpm_avg), sum(bpm_avg::float8), sum(bpm_avg::float8 * bpm_avg),
+       min(temperature), max(temperature), sum(temperature::float8), sum(temperature::float8 * temperature)
+from followhour
+where bpm_avg is not null and temperature is not null
+group by device_id, date_trunc('day', time, 'UTC');
+
+commit;
@@ -0,0 +1,162 @@
+-- Local-day key for followhour readings.
+-- Each device has a timezone; every reading stores the calendar day it fell
+-- on in that timezone, so "readings on 2025-07-27" is one indexed lookup.
+-- Run after 001_followhour_rollups.sql. Daily rollups are rebuilt by local day
+-- in the same transaction, and again for a device whenever its timezone changes.
+
+begin;
+
+create table if not exists devices (
+    device_id text primary key,
+    timezone  text not null default 'Asia/Ho_Chi_Minh'
+);
+insert into devices (device_id) values ('default') on conflict do nothing;
+
+create or replace function device_timezone(p_device_id text) returns text
+language sql stable as $$
+    select coalesce((select timezone from devices where device_id = p_device_id), 'Asia/Ho_Chi_Minh');
+$$;
+
+alter table followhour add column if not exists local_day date;
+
+create or replace function followhour_set_local_day() returns trigger
+language plpgsql as $$
+begin
+    new.local_day := (new.time at time zone device_timezone(new.device_id))::date;
+    return new;
+end;
+$$;
+
+drop trigger if exists followhour_set_local_day on followhour;
+create trigger followhour_set_local_day
+    before insert or update of time, device_id on followhour
+    for each row execute function followhour_set_local_day();
+
+create index if not exists followhour_local_day_idx on followhour (local_day, time, id);
+
+-- Daily rollups now bucket by the device's local midnight instead of UTC.
+create or replace function followhour_rollup_insert() returns trigger
+language plpgsql as $$
+begin
+    if new.bpm_avg is null or new.temperature is null then
+        return new;
+    end if;
+
+    insert into followhour_rollup_hourly as r
+    values (new.device_id, date_trunc('hour', new.time, 'UTC'), 1,
+            new.bpm_avg, new.bpm_avg, new.bpm_avg, new.bpm_avg::float8 * new.bpm_avg,
+            new.temperature, new.temperature, new.temperature, new.temperature::float8 * new.temperature)
+    on conflict (device_id, bucket) do update set
+        count      = r.count + 1,
+        bpm_min    = least(r.bpm_min, excluded.bpm_min),
+        bpm_max    = greatest(r.bpm_max, excluded.bpm_max),
+        bpm_sum    = r.bpm_sum + excluded.bpm_sum,
+        bpm_sumsq  = r.bpm_sumsq + excluded.bpm_sumsq,
+        temp_min   = least(r.temp_min, excluded.temp_min),
+        temp_max   = greatest(r.temp_max, excluded.temp_max),
+        temp_sum   = r.temp_sum + excluded.temp_sum,
+        temp_sumsq = r.temp_sumsq + excluded.temp_sumsq;
+
+    insert into followhour_rollup_daily as r
+    values (new.device_id, date_trunc('day', new.time, device_timezone(new.device_id)), 1,
+            new.bpm_avg, new.bpm_avg, new.bpm_avg, new.bpm_avg::float8 * new.bpm_avg,
+            new.temperature, new.temperature, new.temperature, new.temperature::float8 * new.temperature)
+    on conflict (device_id, bucket) do update set
+        count      = r.count + 1,
+        bpm_min    = least(r.bpm_min, excluded.bpm_min),
+        bpm_max    = greatest(r.bpm_max, excluded.bpm_max),
+        bpm_sum    = r.bpm_sum + excluded.bpm_sum,
+        bpm_sumsq  = r.bpm_sumsq + excluded.bpm_sumsq,
+        temp_min   = least(r.temp_min, excluded.temp_min),
+        temp_max   = greatest(r.temp_max, excluded.temp_max),
+        temp_sum   = r.temp_sum + excluded.temp_sum,
+        temp_sumsq = r.temp_sumsq + excluded.temp_sumsq;
+
+    return new;
+end;
+$$;
+
+-- The readings are REAL; sums are taken in float8, as in 001.
+create or replace function followhour_rollup_delete() returns trigger
+language plpgsql as $$
+begin
+    delete from followhour_rollup_hourly r
+    using (select distinct device_id, date_trunc('hour', time, 'UTC') as bucket from old_rows) t
+    where r.device_id = t.device_id and r.bucket = t.bucket;
+
+    insert into followhour_rollup_hourly
+    select f.device_id, date_trunc('hour', f.time, 'UTC'), count(*),
+           min(f.bpm_avg), max(f.bpm_avg), sum(f.bpm_avg::float8), sum(f.bpm_avg::float8 * f.bpm_avg),
+           min(f.temperature), max(f.temperature), sum(f.temperature::float8), sum(f.temperature::float8 * f.temperature)
+    from followhour f
+    join (select distinct device_id, date_trunc('hour', time, 'UTC') as bucket from old_rows) t
+      on f.device_id = t.device_id
+     and f.time >= t.bucket and f.time < t.bucket + interval '1 hour'
+    where f.bpm_avg is not null and f.temperature is not null
+    group by 1, 2;
+
+    delete from followhour_rollup_daily r
+    using (select distinct device_id, date_trunc('day', time, device_timezone(device_id)) as bucket from old_rows) t
+    where r.device_id = t.device_id and r.bucket = t.bucket;
+
+    insert into followhour_rollup_daily
+    select f.device_id, date_trunc('day', f.time, device_timezone(f.device_id)), count(*),
+           min(f.bpm_avg), max(f.bpm_avg), sum(f.bpm_avg::float8), sum(f.bpm_avg::float8 * f.bpm_avg),
+           min(f.temperature), max(f.temperature), sum(f.temperature::float8), sum(f.temperature::float8 * f.temperature)
+    from followhour f
+    join (select distinct device_id, local_day from old_rows) t
+      on f.device_id = t.device_id and f.local_day = t.local_day
+    where f.bpm_avg is not null and f.temperature is not null
+    group by 1, 2;
+
+    return null;
+end;
+$$;
+
+-- Recomputes local_day and the daily rollups of one device, or of all devices if null.
+-- Writers are blocked until the caller's transaction ends, so no reading can
+-- land between the delete and the reinsert and be lost from its bucket.
+create or replace function followhour_rebuild_daily(p_device_id text default null) returns void
+language plpgsql as $$
+begin
+    lock table followhour in share row exclusive mode;
+
+    update followhour set local_day = (time at time zone device_timezone(device_id))::date
+    where p_device_id is null or device_id = p_device_id;
+
+    delete from followhour_rollup_daily where p_device_id is null or device_id = p_device_id;
+
+    insert into followhour_rollup_daily
+    select device_id, date_trunc('day', time, device_timezone(device_id)), count(*),
+           min(bpm_avg), max(bpm_avg), sum(bpm_avg::float8), sum(bpm_avg::float8 * bpm_avg),
+           min(temperature), max(temperature), sum(temperature::float8), sum(temperature::float8 * temperature)
+    from followhour
+    where (p_device_id is null or device_id = p_device_id)
+      and bpm_avg is not null and temperature is not null
+    group by device_id, date_trunc('day', time, device_timezone(device_id));
+end;
+$$;
+
+-- A device's timezone decides both its local_day values and its daily buckets,
+-- so adding, changing or removing it rebuilds that device's history.
+create or replace function devices_timezone_changed() returns trigger
+language plpgsql as $$
+begin
+    if tg_op = 'DELETE' then
+        perform followhour_rebuild_daily(old.device_id);
+    elsif tg_op = 'INSERT' or old.timezone is distinct from new.timezone then
+        perform followhour_rebuild_daily(new.device_id);
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists devices_timezone_changed on devices;
+create trigger devices_timezone_changed
+    after insert or update of timezone or delete on devices
+    for each row execute function devices_timezone_changed();
+
+-- Existing daily rows are UTC days; rebuild them by local day.
+select followhour_rebuild_daily();
+
+commit;
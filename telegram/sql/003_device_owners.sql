@@ -0,0 +1,8 @@
+-- Owner of each device, so anomaly alerts reach only that device's user.
+-- Run after 002_followhour_local_day.sql, then assign devices to profiles, e.g.:
+--   insert into devices (device_id, profile_id) values ('esp32-01', '<user_profiles.id>')
+--   on conflict (device_id) do update set profile_id = excluded.profile_id;
+-- Devices without an owner raise no alerts.
+
+alter table devices add column if not exists profile_id uuid references user_profiles (id) on delete set null;
+create index if not exists devices_profile_idx on devices (profile_id);
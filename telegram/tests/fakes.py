@@ -0,0 +1,96 @@
+import re
+from datetime import datetime
+
+KEYSET = re.compile(r'(\w+)\.(gt|lt)\."([^"]+)",and\(\w+\.eq\."[^"]+",id\.(?:gt|lt)\.(\d+)\)')
+
+def _value(value):
+    """Compares timestamps as instants, whatever offset they were written with."""
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            pass
+    return value
+
+class FakeQuery:
+    """The slice of the supabase-py query builder the bot uses, over in-memory rows."""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.orders = []
+        self.limit_n = None
+        self.filters = []
+        self.upserted = None
+
+    def select(self, columns):
+        return self
+
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+
+    def _filter(self, column, value, test):
+        value = _value(value)
+        self.filters.append(lambda row: row.get(column) is not None and test(_value(row[column]), value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, value, lambda a, b: a == b)
+
+    def gt(self, column, value):
+        return self._filter(column, value, lambda a, b: a > b)
+
+    def gte(self, column, value):
+        return self._filter(column, value, lambda a, b: a >= b)
+
+    def lt(self, column, value):
+        return self._filter(column, value, lambda a, b: a < b)
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def or_(self, expression):
+        column, op, last_time, last_id = KEYSET.fullmatch(expression).groups()
+        cursor = (_value(last_time), int(last_id))
+        if op == "gt":
+            self.filters.append(lambda row: (_value(row[column]), row["id"]) > cursor)
+        else:
+            self.filters.append(lambda row: (_value(row[column]), row["id"]) < cursor)
+        return self
+
+    def limit(self, n):
+        self.limit_n = n
+        return self
+
+    def upsert(self, rows, on_conflict):
+        self.upserted = (rows, on_conflict.split(","))
+        return self
+
+    def execute(self):
+        table = self.client.tables.setdefault(self.name, [])
+        if self.upserted is not None:
+            rows, keys = self.upserted
+            self.client.upserts.setdefault(self.name, []).extend(rows)
+            for row in rows:
+                key = tuple(_value(row[k]) for k in keys)
+                table[:] = [r for r in table if tuple(_value(r[k]) for k in keys) != key] + [row]
+            self.data = rows
+            return self
+        rows = [row for row in table if all(f(row) for f in self.filters)]
+        for column, desc in reversed(self.orders):
+            rows.sort(key=lambda row: _value(row[column]), reverse=desc)
+        self.data = rows[:min(self.limit_n or self.client.max_rows, self.client.max_rows)]
+        return self
+
+class FakeClient:
+    """Serves at most `max_rows` rows per request, like Supabase's PostgREST default."""
+
+    def __init__(self, tables: dict, max_rows: int = 1000):
+        self.tables = tables
+        self.max_rows = max_rows
+        self.upserts = {}
+
+    def table(self, name):
+        return FakeQuery(self, name)
@@ -0,0 +1,57 @@
+import numpy as np
+
+from anomaly import AnomalyDetector, detect_anomalies
+
+def _stream(n, seed=0):
+    rng = np.random.default_rng(seed)
+    values = np.column_stack([rng.normal(75, 3, n), rng.normal(36.6, 0.1, n)])
+    values[[60, 61, 180], 0] += 40
+    values[150, 1] += 2
+    return values
+
+def test_update_and_update_batch_agree():
+    values = _stream(300)
+    scalar = AnomalyDetector(warmup=10, cooldown=0.0)
+    batch = AnomalyDetector(warmup=10, cooldown=0.0)
+    index = np.array([batch.slot("device")])
+    scalar_flags, batch_flags = [], []
+    for i, (bpm, temp) in enumerate(values):
+        scalar_flags.append(bool(scalar.update("device", bpm, temp, now=float(i))))
+        batch_flags.append(len(batch.update_batch(index, values[i:i + 1], now=float(i))) > 0)
+    assert scalar_flags == batch_flags
+    assert any(scalar_flags)
+    np.testing.assert_allclose(batch.mean, scalar.mean)
+    np.testing.assert_allclose(batch.var, scalar.var)
+    assert batch.count[0] == scalar.count[0] == len(values)
+
+def test_detect_anomalies_matches_update_across_devices():
+    streams = {device: _stream(200, seed) for seed, device in enumerate(["a", "b", "c"])}
+    rows = [{"id": i * 3 + d, "device_id": device, "bpm_avg": float(values[i, 0]), "temperature": float(values[i, 1])}
+            for i in range(200) for d, (device, values) in enumerate(streams.items())]
+    scalar = AnomalyDetector(warmup=10, cooldown=0.0)
+    expected = [(anomaly, row) for row in rows
+                for anomaly in scalar.update(row["device_id"], row["bpm_avg"], row["temperature"], now=0.0)]
+    batched = AnomalyDetector(warmup=10, cooldown=0.0)
+    # Pages mixing several readings per device exercise the multi-pass path.
+    found = [hit for i in range(0, len(rows), 50) for hit in detect_anomalies(batched, rows[i:i + 50], now=0.0)]
+    assert found == expected
+    np.testing.assert_allclose(batched.mean, scalar.mean)
+    np.testing.assert_allclose(batched.var, scalar.var)
+
+def test_warmup_holds_back_alerts():
+    detector = AnomalyDetector(warmup=20, cooldown=0.0)
+    for i in range(19):
+        detector.update("device", 75.0, 36.6, now=float(i))
+    # The 20th reading is still inside the warmup, however far off it is.
+    assert detector.update("device", 200.0, 36.6, now=19.0) == []
+    assert detector.update("device", 200.0, 36.6, now=20.0)
+
+def test_cooldown_holds_back_alerts():
+    detector = AnomalyDetector(warmup=5, cooldown=600.0)
+    for i in range(50):
+        detector.update("device", 75.0, 36.6, now=float(i))
+    assert detector.update("device", 200.0, 36.6, now=100.0)
+    assert detector.update("device", 200.0, 36.6, now=400.0) == []
+    index = np.array([detector.slot("device")])
+    assert len(detector.update_batch(index, np.array([[200.0, 40.0]]), now=500.0)) == 0
+    assert detector.update("device", 200.0, 40.0, now=700.0)
@@ -0,0 +1,29 @@
+import csv
+import gzip
+import os
+from datetime import datetime, timedelta, timezone
+
+from export import export_columns, export_table
+from fakes import FakeClient
+
+def _readings(n, devices):
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    return [{"id": i + 1, "time": (start + timedelta(seconds=15 * i)).isoformat(), "bpm_avg": 70.0,
+             "temperature": 36.6, "device_id": devices[i % len(devices)]} for i in range(n)]
+
+def test_export_only_includes_the_given_devices(tmp_path):
+    rows = _readings(2500, ["mine", "other", "also-mine"])
+    client = FakeClient({"followhour": rows}, max_rows=1000)
+    path, count, error = export_table(client, "followhour", "csv", directory=str(tmp_path), device_ids=["mine", "also-mine"])
+    assert error is None
+    with gzip.open(path, "rt", newline="") as f:
+        exported = list(csv.DictReader(f))
+    os.remove(path)
+    expected = [row for row in rows if row["device_id"] != "other"]
+    assert count == len(exported) == len(expected)
+    assert [int(row["id"]) for row in exported] == [row["id"] for row in expected]
+    assert {row["device_id"] for row in exported} == {"mine", "also-mine"}
+
+def test_onetest_export_has_no_device_column():
+    assert "device_id" in export_columns("followhour")
+    assert "device_id" not in export_columns("onetest")
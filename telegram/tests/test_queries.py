@@ -0,0 +1,24 @@
+from datetime import datetime, timedelta, timezone
+
+from fakes import FakeClient
+from queries import iter_chunks
+
+def _readings(n):
+    start = datetime(2025, 1, 1, tzinfo=timezone.utc)
+    # Pairs of rows share a timestamp so the id tie-breaker is exercised.
+    return [{"id": i + 1, "time": (start + timedelta(seconds=15 * (i // 2))).isoformat()} for i in range(n)]
+
+def test_iter_chunks_reads_past_server_row_cap():
+    client = FakeClient({"followhour": _readings(3500)}, max_rows=1000)
+    pages = list(iter_chunks(client, "followhour", chunk_size=5000))
+    assert [len(page) for page in pages] == [1000, 1000, 1000, 500]
+    assert [row["id"] for page in pages for row in page] == list(range(1, 3501))
+
+def test_iter_chunks_descending_with_range():
+    rows = _readings(2500)
+    client = FakeClient({"followhour": rows}, max_rows=1000)
+    start, end = rows[100]["time"], rows[2400]["time"]
+    ids = [row["id"] for page in iter_chunks(client, "followhour", chunk_size=5000, start=start, end=end, desc=True)
+           for row in page]
+    expected = [row["id"] for row in rows if start <= row["time"] < end]
+    assert ids == sorted(expected, reverse=True)
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta, timezone
+
+from fakes import FakeClient
+from rollups import (
+    ROLLUP_TABLES, RollupBucket, _flush, backfill_rollups, backfill_window, bucket_end, bucket_start, fetch_rollups,
+)
+
+def _rollup_rows(n, device_id="default"):
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    return [{"device_id": device_id, "bucket": (start + timedelta(hours=i)).isoformat(), "count": 1} for i in range(n)]
+
+def test_fetch_rollups_reads_past_server_row_cap():
+    rows = _rollup_rows(2500) + _rollup_rows(10, device_id="other")
+    client = FakeClient({"followhour_rollup_hourly": rows}, max_rows=1000)
+    fetched, error = fetch_rollups(client, "hour")
+    assert error is None
+    assert [row["bucket"] for row in fetched] == [row["bucket"] for row in rows[:2500]]
+
+def test_fetch_rollups_range_is_half_open():
+    rows = _rollup_rows(2500)
+    client = FakeClient({"followhour_rollup_hourly": rows}, max_rows=1000)
+    fetched, _ = fetch_rollups(client, "hour", start=rows[10]["bucket"], end=rows[2110]["bucket"])
+    assert [row["bucket"] for row in fetched] == [row["bucket"] for row in rows[10:2110]]
+
+# --- BACKFILL ---
+def _readings(start, end, step, device_id="default"):
+    rows, t = [], start
+    while t < end:
+        rows.append({"id": len(rows) + 1, "time": t.isoformat(), "bpm_avg": 70.0, "temperature": 36.5,
+                     "device_id": device_id})
+        t += step
+    return rows
+
+def _written(client, grain):
+    return {row["bucket"]: row["count"] for row in client.upserts.get(ROLLUP_TABLES[grain], [])}
+
+def test_backfill_widens_unaligned_start_to_whole_buckets():
+    day = datetime(2025, 1, 10, tzinfo=timezone.utc)
+    readings = _readings(day - timedelta(days=1), day + timedelta(days=2), timedelta(minutes=15))
+    client = FakeClient({"followhour": readings, "devices": []})
+    backfill_rollups(client, start=(day + timedelta(hours=10, minutes=20)).isoformat(),
+                     end=(day + timedelta(hours=13, minutes=5)).isoformat())
+    hourly = _written(client, "hour")
+    # Every written hour holds all four readings, including 10:00 and 13:00.
+    assert set(hourly.values()) == {4}
+    assert (day + timedelta(hours=10)).isoformat() in hourly
+    assert (day + timedelta(hours=13)).isoformat() in hourly
+    # 10:20-13:05 UTC falls in the local day (UTC+7) of Jan 10, which is written whole.
+    assert _written(client, "day") == {"2025-01-10T00:00:00+07:00": 96}
+    assert min(hourly) == "2025-01-09T17:00:00+00:00" and max(hourly) == "2025-01-10T16:00:00+00:00"
+
+def test_backfill_buckets_dst_day_in_device_timezone():
+    start = datetime(2025, 3, 8, 5, tzinfo=timezone.utc)  # midnight EST
+    readings = _readings(start, start + timedelta(days=3), timedelta(minutes=15), device_id="nyc")
+    client = FakeClient({"followhour": readings, "devices": [{"device_id": "nyc", "timezone": "America/New_York"}]})
+    backfill_rollups(client)
+    daily = _written(client, "day")
+    assert daily["2025-03-08T00:00:00-05:00"] == 96
+    assert daily["2025-03-09T00:00:00-05:00"] == 92  # clocks spring forward: a 23-hour day
+    assert daily["2025-03-10T00:00:00-04:00"] == 96
+
+def test_backfill_never_writes_open_buckets():
+    now = datetime.now(timezone.utc)
+    readings = _readings(now - timedelta(hours=3), now, timedelta(minutes=1))
+    client = FakeClient({"followhour": readings, "devices": []})
+    backfill_rollups(client)
+    current_hour = bucket_start(now, "hour")
+    hourly = [datetime.fromisoformat(bucket) for bucket in _written(client, "hour")]
+    assert hourly and all(bucket_end(bucket, "hour") <= now for bucket in hourly)
+    assert current_hour not in hourly
+    today = bucket_start(now, "day")
+    assert today.isoformat() not in _written(client, "day")
+
+def test_backfill_window_caps_end_at_now():
+    now = datetime(2025, 1, 10, 12, 30, tzinfo=timezone.utc)
+    start, end = backfill_window(datetime(2025, 1, 9, 3, 20, tzinfo=timezone.utc), None, now, {"Asia/Ho_Chi_Minh"})
+    assert start == datetime(2025, 1, 8, 17, tzinfo=timezone.utc)  # local midnight of Jan 9, before 03:00 UTC
+    assert end == now
+    _, end = backfill_window(None, datetime(2025, 1, 10, 1, 10, tzinfo=timezone.utc), now, {"Asia/Ho_Chi_Minh"})
+    assert end == datetime(2025, 1, 10, 12, 30, tzinfo=timezone.utc)  # the local day runs to 17:00 UTC
+
+def test_flush_drops_partly_scanned_buckets():
+    client = FakeClient({})
+    buckets = {}
+    for hour in (9, 10, 11):
+        bucket = RollupBucket()
+        bucket.add(70.0, 36.5)
+        buckets[("default", datetime(2025, 1, 1, hour, tzinfo=timezone.utc))] = bucket
+    written = _flush(client, "hour", buckets, before=datetime(2025, 1, 1, 11, tzinfo=timezone.utc),
+                     not_before=datetime(2025, 1, 1, 10, tzinfo=timezone.utc))
+    assert written == 1
+    assert list(_written(client, "hour")) == ["2025-01-01T10:00:00+00:00"]
+    assert list(buckets) == [("default", datetime(2025, 1, 1, 11, tzinfo=timezone.utc))]
@@ -0,0 +1,20 @@
+from sessions import SessionStore
+
+def test_users_in_one_chat_get_separate_sessions():
+    store = SessionStore()
+    first = store.start(-100, 1, "data")
+    second = store.start(-100, 2, "data")
+    first.table_choice = "followhour"
+    assert store.get(-100, 2, "data") is second
+    assert second.table_choice is None
+    store.discard(-100, 2)
+    assert store.get(-100, 2, "data") is None
+    assert store.get(-100, 1, "data") is first
+
+def test_flows_are_separate():
+    store = SessionStore()
+    data = store.start(1, 1, "data")
+    store.start(1, 1, "timer")
+    store.discard(1, 1, "timer")
+    assert store.get(1, 1, "timer") is None
+    assert store.get(1, 1, "data") is data